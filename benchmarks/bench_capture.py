@@ -0,0 +1,171 @@
+"""Benchmark the capturers on synthetic build logs.
+
+    python benchmarks/bench_capture.py [--build maven,gradle,ant] [--modules 300]
+        [--files-per-module 100] [--classpath-length 50] [--noise-per-module 10000]
+        [--legacy] [--json results.json]
+
+For each build system, a synthetic log (see synthetic_logs.py) is written
+to a temporary file, then replayed through the capturer offline, in a fresh
+process so that its peak memory can be measured. Reported per build system:
+the time taken by each phase (generating the log, parsing it, recording
+stats), parsing throughput in lines/sec, and peak RSS. --legacy also runs
+the multi-pass Maven parser the line classifier replaced, for comparison.
+--json writes the results, with the configuration, to a file so that
+regressions can be tracked over time."""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import re
+import resource
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from do_like_javac.capture import ant, gradle, mvn
+
+import synthetic_logs
+
+BUILDS = {
+    'maven': (synthetic_logs.maven_log, mvn.MavenCapture),
+    'gradle': (synthetic_logs.gradle_log, gradle.GradleCapture),
+    'ant': (synthetic_logs.ant_log, ant.AntCapture),
+}
+
+def read_lines(filename):
+    with open(filename) as f:
+        for line in f:
+            yield line.rstrip('\n')
+
+def legacy_maven_parse(filename):
+    """The javac commands and jars found by the parser before the line
+    classifier: an uncompiled re.match and two substring scans per line,
+    and a second pass over the log for the jars."""
+    file_pattern = r'\[DEBUG\] Stale source detected: ([^ ]*\.java)'
+    options_pattern = '[DEBUG] Command line options:'
+    jar_pattern = '[INFO] Building jar: '
+
+    javac_commands = []
+    files_to_compile = []
+    options_next = False
+    for line in read_lines(filename):
+        if options_next:
+            javac_commands.append(line.split(' ')[1:] + files_to_compile)
+            options_next = False
+            files_to_compile = []
+        elif options_pattern in line:
+            options_next = True
+        else:
+            found = re.match(file_pattern, line)
+            if found:
+                files_to_compile.append(found.group(1))
+
+    jars = []
+    for line in read_lines(filename):
+        if jar_pattern in line:
+            jars.append(line[line.index(jar_pattern) + len(jar_pattern):].strip())
+
+    return javac_commands, jars
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def replay(build, log_file, legacy):
+    """Parse log_file with the capturer for build. Runs in a child process."""
+    args = argparse.Namespace(guess_source=False, output_directory=None)
+    phases = {}
+
+    start_time = timeit.default_timer()
+    if legacy:
+        javac_commands, jars = legacy_maven_parse(log_file)
+    else:
+        capturer = BUILDS[build][1]([build], args)
+        javac_commands, jars = capturer.parse_output(read_lines(log_file))
+    phases['parse'] = timeit.default_timer() - start_time
+
+    if not legacy:
+        start_time = timeit.default_timer()
+        capturer.record_stats({}, javac_commands, [{'jar': jar} for jar in jars])
+        phases['record_stats'] = timeit.default_timer() - start_time
+
+    return {'phases': phases,
+            'javac_commands': len(javac_commands),
+            'java_files': sum(len(jc['java_files']) for jc in javac_commands) if not legacy else None,
+            'jars': len(jars),
+            'peak_rss_bytes': peak_rss_bytes()}
+
+def run_case(build, config, legacy=False):
+    generate = BUILDS[build][0]
+
+    start_time = timeit.default_timer()
+    with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False) as f:
+        lines = 0
+        for line in generate(**config):
+            f.write(line)
+            f.write('\n')
+            lines += 1
+        log_file = f.name
+    generate_time = timeit.default_timer() - start_time
+
+    try:
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            result = pool.apply(replay, (build, log_file, legacy))
+        log_bytes = os.path.getsize(log_file)
+    finally:
+        os.remove(log_file)
+
+    result['phases'] = dict(generate=generate_time, **result['phases'])
+    result.update(build=build + (' (multi-pass)' if legacy else ''),
+                  lines=lines,
+                  log_bytes=log_bytes,
+                  lines_per_sec=lines / result['phases']['parse'])
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--build', default=','.join(BUILDS),
+                        help='Comma separated build systems to benchmark: ' + ', '.join(BUILDS))
+    parser.add_argument('--modules', type=int, default=300)
+    parser.add_argument('--files-per-module', type=int, default=100)
+    parser.add_argument('--classpath-length', type=int, default=50)
+    parser.add_argument('--noise-per-module', type=int, default=10000,
+                        help='Irrelevant debug lines logged for each module')
+    parser.add_argument('--legacy', action='store_true',
+                        help='Also run the multi-pass Maven parser')
+    parser.add_argument('--json', metavar='<file>',
+                        help='Write the results to <file> as JSON')
+    options = parser.parse_args()
+
+    config = {'modules': options.modules,
+              'files_per_module': options.files_per_module,
+              'classpath_length': options.classpath_length,
+              'noise_per_module': options.noise_per_module}
+
+    results = []
+    for build in options.build.split(','):
+        cases = [False, True] if build == 'maven' and options.legacy else [False]
+        for legacy in cases:
+            result = run_case(build, config, legacy)
+            results.append(result)
+            phases = '  '.join(f"{name} {seconds:.2f}s" for name, seconds in result['phases'].items())
+            print(f"{result['build']:>20}: {result['lines']:>10} lines  "
+                  f"{result['lines_per_sec']:>12,.0f} lines/sec  "
+                  f"peak {result['peak_rss_bytes'] / 2**20:7.1f} MiB  {phases}")
+
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump({'date': datetime.datetime.now().isoformat(),
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'config': config,
+                       'results': results}, f, indent=4)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Generators of synthetic build logs, for benchmarking the capturers
+without running a real build."""
+
+import random
+
+def maven_log(modules=300, files_per_module=100, classpath_length=50,
+              noise_per_module=10000, seed=0):
+    """Yield the lines of an `mvn -X -B` log for a multi-module build. Each
+    module contributes a burst of plugin-configuration debug noise, its
+    stale sources, the javac command line and the jar it builds."""
+    rng = random.Random(seed)
+    noise = ['[DEBUG]   (f) basedir = /work/project/module{m}',
+             '[DEBUG]   (f) compilePath = [/work/project/module{m}/target/classes]',
+             '[DEBUG] Resolving artifact org.example:lib{n}:jar:1.{n}.0 from [central (https://repo.maven.apache.org/maven2, default, releases)]',
+             '[DEBUG] Using connector BasicRepositoryConnector with priority 0.0 for https://repo.maven.apache.org/maven2',
+             '[DEBUG]    org.example:lib{n}:jar:1.{n}.0:compile',
+             '[INFO] Downloaded from central: https://repo.maven.apache.org/maven2/org/example/lib{n}/1.{n}.0/lib{n}-1.{n}.0.pom',
+             '[DEBUG] Configuring mojo org.apache.maven.plugins:maven-compiler-plugin:3.8.1:compile from plugin realm ClassRealm[plugin>org.apache.maven.plugins:maven-compiler-plugin:3.8.1, parent: jdk.internal.loader.ClassLoaders$AppClassLoader@{n}]']
+
+    for m in range(modules):
+        base = f'/work/project/module{m}'
+        yield f'[INFO] Building module{m} 1.0-SNAPSHOT [{m + 1}/{modules}]'
+        for i in range(noise_per_module):
+            yield rng.choice(noise).format(m=m, n=i % 997)
+
+        sources = [f'{base}/src/main/java/org/example/m{m}/Class{f}.java'
+                   for f in range(files_per_module)]
+        for source in sources:
+            yield f'[DEBUG] Stale source detected: {source}'
+
+        classpath = [f'{base}/target/classes'] + \
+            [f'/home/user/.m2/repository/org/example/lib{j}/1.{j}.0/lib{j}-1.{j}.0.jar'
+             for j in range(classpath_length)]
+        yield '[DEBUG] Command line options:'
+        yield (f'[DEBUG] -d {base}/target/classes -classpath {":".join(classpath)} '
+               f'-sourcepath {base}/src/main/java: -g -nowarn -target 1.8 -source 1.8 -encoding UTF-8')
+        yield f'[INFO] Building jar: {base}/target/module{m}-1.0-SNAPSHOT.jar'
+
+def gradle_log(modules=300, files_per_module=100, classpath_length=50,
+               noise_per_module=10000, seed=0):
+    """Yield the lines of a `gradle --debug` log for a multi-project build.
+    Each project's compileJava task logs its compiler arguments on one line,
+    among the usual flood of timestamped debug messages."""
+    rng = random.Random(seed)
+    prefix = '2024-01-01T12:00:00.000+0000 [DEBUG] '
+    noise = [prefix + '[org.gradle.internal.operations.DefaultBuildOperationRunner] Build operation \'Resolve files of :module{m}:compileClasspath\' completed',
+             prefix + '[org.gradle.cache.internal.DefaultFileLockManager] Waiting to acquire shared lock on /home/user/.gradle/caches/modules-2/files-2.1/org.example/lib{n}',
+             prefix + '[org.gradle.api.internal.artifacts.ivyservice.ivyresolve.RepositoryChainComponentMetaDataResolver] Using org.example:lib{n}:1.{n}.0 from Maven repository \'MavenRepo\'',
+             '2024-01-01T12:00:00.000+0000 [LIFECYCLE] [class org.gradle.internal.buildevents.TaskExecutionLogger] > Task :module{m}:processResources',
+             prefix + '[org.gradle.internal.execution.steps.SkipEmptyWorkStep] Skipping task \':module{m}:processTestResources\' as it has no source files']
+
+    for m in range(modules):
+        base = f'/work/project/module{m}'
+        for i in range(noise_per_module):
+            yield rng.choice(noise).format(m=m, n=i % 997)
+
+        classpath = [f'/home/user/.gradle/caches/modules-2/files-2.1/org.example/lib{j}/1.{j}.0/abc{j}/lib{j}-1.{j}.0.jar'
+                     for j in range(classpath_length)]
+        sources = [f'{base}/src/main/java/org/example/m{m}/Class{f}.java'
+                   for f in range(files_per_module)]
+        yield (prefix + '[org.gradle.api.internal.tasks.compile.NormalizingJavaCompiler] Compiler arguments: '
+               f'-source 1.8 -target 1.8 -d {base}/build/classes/java/main -encoding UTF-8 -g '
+               f'-sourcepath  -proc:none -XDuseUnsharedTable=true -classpath {":".join(classpath)} '
+               + ' '.join(sources))
+        yield f'2024-01-01T12:00:00.000+0000 [LIFECYCLE] [class org.gradle.internal.buildevents.TaskExecutionLogger] > Task :module{m}:jar'
+
+def ant_log(modules=300, files_per_module=100, classpath_length=50,
+            noise_per_module=10000, seed=0):
+    """Yield the lines of an `ant -verbose` log for a build with one javac
+    and one jar task per module. Ant logs each javac argument on its own
+    quoted line, followed by the files to be compiled."""
+    rng = random.Random(seed)
+    noise = ['    [mkdir] Skipping /work/project/module{m}/build because it already exists.',
+             'Property "module{m}.skip" has not been set',
+             '     [copy] /work/project/module{m}/res/file{n}.properties omitted as /work/project/module{m}/build/file{n}.properties is up to date.',
+             'Build sequence for target(s) `jar\' is [init, compile{m}, jar{m}]',
+             '    [javac] /work/project/module{m}/src/org/example/Old{n}.java omitted as Old{n}.class is up to date.']
+
+    for m in range(modules):
+        base = f'/work/project/module{m}'
+        for i in range(noise_per_module):
+            yield rng.choice(noise).format(m=m, n=i % 997)
+
+        classpath = [f'/work/project/lib/lib{j}-1.{j}.0.jar' for j in range(classpath_length)]
+        yield f'compile{m}:'
+        yield '    [javac] Compilation arguments:'
+        for arg in ['-d', f'{base}/build', '-classpath', ':'.join(classpath),
+                    '-sourcepath', f'{base}/src', '-g:none', '-target', '1.8', '-source', '1.8']:
+            yield f"    [javac] '{arg}'"
+        yield '    [javac] '
+        yield '    [javac] The \' characters around the executable and arguments are'
+        yield '    [javac] not part of the command.'
+        yield '    [javac] Files to be compiled:'
+        for f in range(files_per_module):
+            yield f'    [javac]     {base}/src/org/example/m{m}/Class{f}.java'
+        yield f'      [jar] Building jar: {base}/dist/module{m}.jar'
@@ -14,6 +14,21 @@ from . import capture, tools
 
 DEFAULT_OUTPUT_DIRECTORY = os.path.join(os.getcwd(), 'dljc-out')
 
+def memory_size(value):
+    try:
+        return tools.common.parse_size(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a size such as 512M or 16G, not {value!r}")
+
+def positive_int(value):
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive integer, not {value!r}")
+    return number
+
 # token that identifies the end of the options for do-like-javac and the beginning
 # of the compilation command
 CMD_MARKER = '--'
@@ -42,15 +57,59 @@ base_group.add_argument('--timeout', metavar='<seconds>',
                         type=int,
                         help='The maximum time to run any subcommand.')
 
+base_group.add_argument('--jobs', metavar='<n>',
+                        action='store', default=1,
+                        type=positive_int,
+                        help='The number of javac commands to run tools on at once.')
+
+base_group.add_argument('--memory-limit', metavar='<size>',
+                        action='store', default=None, dest='memory_limit',
+                        type=memory_size,
+                        help='''The total heap (e.g. 16G) of the JVMs dljc runs at once. Defaults to
+                        the physical memory of the machine.''')
+
+base_group.add_argument('--cpu-limit', metavar='<n>',
+                        action='store', default=None,
+                        type=positive_int, dest='cpu_limit',
+                        help='The number of cores the JVMs dljc runs at once may use. Defaults to all of them.')
+
+base_group.add_argument('--incremental', action='store_true',
+                        help='''Only re-run tools on javac commands whose sources, classpath or
+                        tool arguments changed since the last run, replaying the logs of the rest''')
+
 base_group.add_argument('--guess', action='store_true', dest='guess_source',
                         help="Guess source files if not present in build output.")
 
+base_group.add_argument('--guess-ignore', metavar='<glob>',
+                        action='append', dest='guess_ignore',
+                        help='''Skip files and directories whose paths match <glob> when guessing
+                        source files (may be given more than once)''')
+
 base_group.add_argument('--quiet', action='store_false', dest='verbose',
                         help="Suppress output from subcommands.")
 
 base_group.add_argument('--cache', action='store_true',
                         help='''Use the dljc cache (if available)''')
 
+base_group.add_argument('--cache-size', metavar='<entries>',
+                        action='store', default=5,
+                        type=int, dest='cache_size',
+                        help='The number of builds to keep in the dljc cache.')
+
+base_group.add_argument('--from-log', metavar='<file>',
+                        action=AbsolutePathAction, dest='from_log',
+                        help='''Capture javac commands from the saved output of an earlier run of the
+                        build command (as written to build_output.txt), which may be compressed with
+                        gzip or zstd, instead of running the build''')
+
+base_group.add_argument('--capture-mode', metavar='<mode>',
+                        choices=['log', 'shim', 'plugin'], default='log', dest='capture_mode',
+                        help='''How to capture the javac commands of the build: "log" (the default)
+                        parses the verbose output of a supported build command; "shim" puts a javac
+                        on the PATH that records each invocation, and works with any build command
+                        that runs javac as a separate process; "plugin" has the build tool (Gradle or Maven)
+                        record the configuration of each compilation itself''')
+
 base_group.add_argument('-c', '--checker', metavar='<checker>',
                         action='store', 
                         # do not run the NullnessChecker by default
@@ -82,6 +141,12 @@ base_group.add_argument('--extraJavacArgs', metavar='<extraJavacArgs>',
                         help='List of extra arguments to pass to javac when running a Checker Framework checker. Use this for '
                              'arguments that are only needed when running a checker, such as -AassumeSideEffectFree.')
 
+base_group.add_argument('--compile-server', action='store_true', dest='compile_server',
+                        help='Run Checker Framework compilations (for the checker and wpi tools) in a '
+                             'long-lived Nailgun server instead of a new JVM for each one. Requires '
+                             'the ng client on the PATH, nailgun-server.jar in the --lib directory, '
+                             'and --jdkVersion 11 or later.')
+
 def split_args_to_parse():
     split_index = len(sys.argv)
     if CMD_MARKER in sys.argv:
@@ -90,8 +155,7 @@ def split_args_to_parse():
     args, cmd = sys.argv[1:split_index], sys.argv[split_index + 1:]
 
     command_name = os.path.basename(cmd[0]) if len(cmd) > 0 else None
-    capturer = capture.get_capturer(command_name)
-    return args, cmd, capturer
+    return args, cmd, command_name
 
 def create_argparser():
     parser = argparse.ArgumentParser(
@@ -116,11 +180,12 @@ def create_argparser():
     return parser
 
 def parse_args():
-    to_parse, cmd, capturer = split_args_to_parse()
+    to_parse, cmd, command_name = split_args_to_parse()
 
     global_argparser = create_argparser()
 
     args = global_argparser.parse_args(to_parse)
+    capturer = capture.get_capturer(command_name, args.capture_mode)
 
     if capturer:
         return args, cmd, capturer
@@ -1,13 +1,47 @@
+import hashlib
+import json
 import os
-import pickle
+
+from .tools import common
+
+# The format of cache entries and the index (see common.load_json).
+CACHE_VERSION = 1
+CACHE_DIR = 'dljc-cache'
+INDEX_FILE = 'index.json'
+
+# Files whose contents affect which javac commands a build runs.
+BUILD_FILES = ('pom.xml',
+               'build.gradle', 'build.gradle.kts',
+               'settings.gradle', 'settings.gradle.kts',
+               'gradle.properties',
+               'build.xml')
+
+# The build files of a project, next to which these directories hold the
+# build's outputs rather than its inputs. Generated sources in there must
+# not invalidate the cache entry written by the same build; elsewhere, they
+# are ordinary directories (e.g. a package named build).
+PROJECT_FILES = ('pom.xml', 'build.gradle', 'build.gradle.kts', 'build.xml')
+IGNORED_DIRS = ('target', 'build', 'bin')
+
+# Hidden directories whose files, like build files, configure the build
+# (Maven's jvm.config, maven.config and extensions.xml).
+CONFIG_DIRS = ('.mvn',)
 
 
 def retrieve(cmd, args, capturer):
-  cache_file = os.path.join(args.output_directory, "dljc.cache")
+  if args.from_log:
+    # The log need not come from the project in the current directory, so
+    # the cache key would not describe it.
+    return capturer.gen_instance(cmd, args).capture()
 
-  if args.cache and os.path.exists(cache_file):
-    with open(cache_file, 'rb') as f:
-      return pickle.load(f)
+  cache_dir = os.path.join(args.output_directory, CACHE_DIR)
+  key = cache_key(cmd, args)
+
+  if args.cache:
+    entry = load_entry(cache_dir, key)
+    if entry:
+      touch_index(cache_dir, key, args.cache_size)
+      return entry['javac_commands'], entry['jars'], entry['stats']
 
   result = capturer.gen_instance(cmd, args).capture()
 
@@ -15,7 +49,75 @@ def retrieve(cmd, args, capturer):
     return None
 
   javac_commands, jars, stats = result
-  with open(cache_file, 'wb') as f:
-    pickle.dump((javac_commands, jars, stats), f)
+  store_entry(cache_dir, key, cmd, javac_commands, jars, stats)
+  touch_index(cache_dir, key, args.cache_size)
 
   return javac_commands, jars, stats
+
+def cache_key(cmd, args):
+  """A hash of the build command, the contents of the build files (and of
+  the files under CONFIG_DIRS) and the names, sizes and modification times
+  of the Java sources under the current directory."""
+  digest = hashlib.sha256()
+  digest.update(json.dumps([CACHE_VERSION, cmd, args.guess_source, args.guess_ignore, args.capture_mode]).encode('utf-8'))
+
+  output_directory = os.path.abspath(args.output_directory)
+  root = os.getcwd()
+  for dirname, subdirs, files in os.walk(root):
+    in_config_dir = os.path.relpath(dirname, root).split(os.sep)[0] in CONFIG_DIRS
+    is_project = any(file in PROJECT_FILES for file in files)
+    subdirs[:] = sorted(d for d in subdirs
+                        if (not d.startswith('.') or (dirname == root and d in CONFIG_DIRS))
+                        and not (is_project and d in IGNORED_DIRS)
+                        and os.path.join(dirname, d) != output_directory)
+    for file in sorted(files):
+      path = os.path.join(dirname, file)
+      if file in BUILD_FILES or in_config_dir:
+        digest.update(path.encode('utf-8'))
+        with open(path, 'rb') as f:
+          digest.update(hashlib.sha256(f.read()).digest())
+      elif file.endswith('.java'):
+        stat = os.stat(path)
+        digest.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode('utf-8'))
+
+  return digest.hexdigest()
+
+def entry_file(cache_dir, key):
+  return os.path.join(cache_dir, f"{key}.json")
+
+def load_entry(cache_dir, key):
+  entry = common.load_json(entry_file(cache_dir, key), CACHE_VERSION)
+  if not entry or entry.get('key') != key:
+    return None
+  return entry
+
+def store_entry(cache_dir, key, cmd, javac_commands, jars, stats):
+  entry = {'version': CACHE_VERSION,
+           'key': key,
+           'cmd': cmd,
+           'javac_commands': javac_commands,
+           'jars': jars,
+           'stats': stats}
+  common.write_json(entry_file(cache_dir, key), entry)
+
+def load_index(cache_dir):
+  index = common.load_json(os.path.join(cache_dir, INDEX_FILE), CACHE_VERSION)
+  if not index:
+    return []
+  return index.get('entries', [])
+
+def touch_index(cache_dir, key, size):
+  """Mark key as the most recently used entry, and evict the least recently
+  used entries so that at most size remain."""
+  size = max(size, 1)
+  keys = [k for k in load_index(cache_dir) if k != key] + [key]
+  evicted, keys = keys[:-size], keys[-size:]
+
+  for k in evicted:
+    try:
+      os.remove(entry_file(cache_dir, k))
+    except OSError:
+      pass
+
+  common.write_json(os.path.join(cache_dir, INDEX_FILE),
+                    {'version': CACHE_VERSION, 'entries': keys})
@@ -1,12 +1,19 @@
-from . import ant, gradle, javac, mvn
+from . import ant, gradle, javac, mvn, shim
 
 capture_modules = [ant, gradle, javac, mvn]
 
+# The modules with a capturer for --capture-mode plugin.
+plugin_modules = [gradle, mvn]
+
 def supported_commands():
   module_commands = [mod.supported_commands for mod in capture_modules]
   return [cmd for commands in module_commands for cmd in commands]
 
-def get_capturer(cmd):
+def get_capturer(cmd, capture_mode='log'):
+  if cmd and capture_mode == 'shim':
+    return shim
+  if capture_mode == 'plugin':
+    return next((mod for mod in plugin_modules if cmd in mod.supported_commands), None)
   for mod in capture_modules:
     if cmd in mod.supported_commands:
       return mod
@@ -19,6 +19,12 @@ class AntCapture(generic.GenericCapture):
         super(AntCapture, self).__init__(cmd, args)
         self.build_cmd = ['ant', '-verbose'] + cmd[1:]
 
+        self.javac_arguments = []
+        self.collect = False
+
+        self.classifier.add('[jar] Building jar: ', self.target_jar)
+        self.classifier.add('[javac]', self.javac_line)
+
     def is_interesting(self, content):
         return self.is_quoted(content) or content.endswith('.java')
 
@@ -33,37 +39,25 @@ class AntCapture(generic.GenericCapture):
         else:
             return argument
 
-    def get_target_jars(self, verbose_output):
-        jar_pattern = '[jar] Building jar: '
-        jars = []
-
-        for line in verbose_output:
-            if jar_pattern in line:
-                pos = line.index(jar_pattern) + len(jar_pattern)
-                jar = line[pos:].strip()
-                jars.append(jar)
+    def target_jar(self, line, match):
+        self.target_jars.append(line[match.end():].strip())
 
-        return jars
-
-    def get_javac_commands(self, verbose_output):
-        javac_pattern = '[javac]'
+    def javac_line(self, line, match):
         argument_start_pattern = 'Compilation arguments'
-        javac_arguments = []
-        javac_commands = []
-        collect = False
-        for line in verbose_output:
-            if javac_pattern in line:
-                if argument_start_pattern in line:
-                    collect = True
-                    if javac_arguments != []:
-                        javac_commands.append(javac_arguments)
-                        javac_arguments = []
-                if collect:
-                    pos = line.index(javac_pattern) + len(javac_pattern)
-                    content = line[pos:].strip()
-                    if self.is_interesting(content):
-                        arg = self.remove_quotes(content)
-                        javac_arguments.append(arg)
-        if javac_arguments != []:
-            javac_commands.append(javac_arguments)
-        return list(map(self.javac_parse, javac_commands))
+
+        if argument_start_pattern in line:
+            self.collect = True
+            self.flush_javac_arguments()
+        if self.collect:
+            content = line[match.end():].strip()
+            if self.is_interesting(content):
+                arg = self.remove_quotes(content)
+                self.javac_arguments.append(arg)
+
+    def finish_parse(self):
+        self.flush_javac_arguments()
+
+    def flush_javac_arguments(self):
+        if self.javac_arguments != []:
+            self.javac_commands.append(self.javac_parse(self.javac_arguments))
+            self.javac_arguments = []
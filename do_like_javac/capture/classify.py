@@ -0,0 +1,48 @@
+import re
+
+class LineClassifier(object):
+    """Dispatches each line of build output to the handlers interested in it.
+
+    Handlers are registered with a literal marker that identifies the lines
+    they want. The markers of all handlers are combined into one compiled
+    regular expression, so each line is scanned once, however many handlers
+    there are. A handler is called with the line and the match of its marker,
+    and is only called for the first marker found in the line.
+
+    A handler can also claim the next line with claim_next_line, e.g. when a
+    marker announces that the line after it holds the data."""
+
+    def __init__(self):
+        self.handlers = {}
+        self.pattern = None
+        self.next_line_handler = None
+
+    def add(self, marker, handler):
+        self.handlers.setdefault(marker, []).append(handler)
+        self.pattern = None
+
+    def claim_next_line(self, handler):
+        """Pass the next line to handler, with no match, instead of
+        classifying it."""
+        self.next_line_handler = handler
+
+    def compile(self):
+        # Longer markers first, so a marker that contains another one wins.
+        markers = sorted(self.handlers, key=len, reverse=True)
+        self.pattern = re.compile('|'.join(map(re.escape, markers)))
+
+    def classify(self, line):
+        if self.next_line_handler:
+            handler, self.next_line_handler = self.next_line_handler, None
+            handler(line, None)
+            return
+
+        if not self.handlers:
+            return
+        if not self.pattern:
+            self.compile()
+
+        match = self.pattern.search(line)
+        if match:
+            for handler in self.handlers[match.group()]:
+                handler(line, match)
@@ -1,9 +1,16 @@
+import concurrent.futures
+import functools
+import gzip
+import io
+import json
 import os
 import timeit
 import zipfile
 
 import do_like_javac.tools.common as cmdtools
 
+from . import classify, manifest, source_index
+
 
 def is_switch(s):
     return s != None and s.startswith('-')
@@ -14,91 +21,351 @@ def is_switch_first_part(s):
 def is_switch_first_part(s):
     return s != None and s.startswith('-') and ("=" not in s)
 
+QUOTES = ('"', "'")
+
+def split_arguments(line):
+    r"""Split a logged command line into arguments at single spaces, like
+    line.split(' '), except that double quotes, which is how Maven and
+    Gradle quote arguments containing spaces, group the characters between
+    them, spaces included, into one argument. Single quotes are ordinary
+    characters, since they turn up unquoted in paths.
+
+    >>> split_arguments('-d "/tmp/my classes" -cp /home/o\'neil/lib.jar A.java')
+    ['-d', '/tmp/my classes', '-cp', "/home/o'neil/lib.jar", 'A.java']
+    """
+    if '"' not in line:
+        return line.split(' ')
+
+    arguments = []
+    current = []
+    quoted = False
+    for c in line:
+        if c == '"':
+            quoted = not quoted
+        elif c == ' ' and not quoted:
+            arguments.append(''.join(current))
+            current = []
+        else:
+            current.append(c)
+    arguments.append(''.join(current))
+    return arguments
+
+ARGFILE_ESCAPES = {'n': '\n', 'r': '\r', 't': '\t', 'f': '\f'}
+
+def parse_argfile(text):
+    """Split the contents of a javac @argfile into arguments, as javac does:
+    arguments are separated by whitespace, quotes (single or double) group
+    characters into one argument and may contain backslash escapes, and a
+    # outside an argument starts a comment that runs to the end of the
+    line."""
+    arguments = []
+    i, n = 0, len(text)
+    while i < n:
+        c = text[i]
+        if c.isspace():
+            i += 1
+            continue
+        if c == '#':
+            end = text.find('\n', i)
+            i = n if end < 0 else end + 1
+            continue
+
+        current = []
+        while i < n and not text[i].isspace():
+            c = text[i]
+            if c not in QUOTES:
+                current.append(c)
+                i += 1
+                continue
+
+            quote = c
+            i += 1
+            while i < n and text[i] != quote:
+                c = text[i]
+                if c == '\\' and i + 1 < n:
+                    escaped = text[i + 1]
+                    i += 2
+                    if escaped == '\n' or escaped == '\r':
+                        # a line continuation: skip the next line's indentation
+                        while i < n and text[i] in ' \t\r\n':
+                            i += 1
+                    else:
+                        current.append(ARGFILE_ESCAPES.get(escaped, escaped))
+                else:
+                    current.append(c)
+                    i += 1
+            i += 1
+        arguments.append(''.join(current))
+    return arguments
+
+@functools.lru_cache(maxsize=None)
+def read_argfile(path, mtime_ns, size):
+    with open(path, errors='replace') as f:
+        return tuple(parse_argfile(f.read()))
+
+def argfile_arguments(path):
+    """The arguments in the @argfile at path, or None if it can't be read
+    (build tools often delete their argfiles once javac has run). Each file
+    is only read and parsed once, unless it changes."""
+    try:
+        stat = os.stat(path)
+        return read_argfile(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+def expand_argfiles(arguments, argfiles=None, cwd=None):
+    """Yield arguments, with each @argfile replaced by the arguments in it.
+    argfiles maps @argfile arguments to the contents of the files, if they
+    were saved when the command ran; other argfiles are read from disk,
+    relative to cwd, when they are reached."""
+    for argument in arguments:
+        if argument.startswith('@') and len(argument) > 1:
+            if argfiles and argument in argfiles:
+                yield from parse_argfile(argfiles[argument])
+                continue
+            expanded = argfile_arguments(os.path.join(cwd or '', argument[1:]))
+            if expanded is not None:
+                yield from expanded
+                continue
+        yield argument
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+def promote_to_wrapper(build_cmd, wrapper):
+    """Run build_cmd with the build tool's wrapper script (e.g. gradlew)
+    instead, if the project has one."""
+    if os.path.exists(wrapper):
+        build_cmd[0] = './' + wrapper
+
+def read_build_log(filename):
+    """Yield the lines of a saved build log, without their newlines. The log
+    may be compressed with gzip or zstd (which needs the zstandard
+    package); it is decompressed as it is read."""
+    with open(filename, 'rb') as raw:
+        magic = raw.read(4)
+        raw.seek(0)
+
+        if magic.startswith(GZIP_MAGIC):
+            stream = gzip.GzipFile(fileobj=raw)
+        elif magic == ZSTD_MAGIC:
+            try:
+                import zstandard
+            except ImportError:
+                raise ValueError(f"{filename} is compressed with zstd; install the zstandard package to read it")
+            stream = zstandard.ZstdDecompressor().stream_reader(raw)
+        else:
+            stream = raw
+
+        for line in io.TextIOWrapper(stream, encoding='utf-8', errors='replace'):
+            yield line.rstrip('\n')
+
+def read_records(filename):
+    """Yield the JSON records, one per line, in a record file written
+    while the build ran."""
+    if not os.path.exists(filename):
+        return
+    with open(filename) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+# The format of the manifest cache (see common.load_json).
+MANIFEST_CACHE_VERSION = 1
+MANIFEST_CACHE_FILE = 'dljc-manifest-cache.json'
+
 def get_entry_point(jar):
-    class_pattern = "Main-Class:"
+    if not os.path.isfile(jar):
+        # e.g. a jar named in a build log replayed on another machine
+        return {"jar": jar}
+
+    try:
+        main = manifest.main_class(jar)
+    except (OSError, zipfile.BadZipFile) as e:
+        print(f"ERROR: unable to read META-INF/MANIFEST.MF. See: {e}")
+        main = None
+
+    if main:
+        return {"jar": jar, "main": main}
+    return {"jar": jar}
 
-    with zipfile.ZipFile(jar, 'r') as zip:
-        metadata = []
+def get_entry_points(jars, cache_file=None):
+    """get_entry_point for each of jars, reading their manifests in
+    parallel. The entry points found are saved in cache_file, keyed on the
+    path, size and modification time of each jar, and a jar that is
+    unchanged since the last run is not read again."""
+    cached = {}
+    saved = cmdtools.load_json(cache_file, MANIFEST_CACHE_VERSION) if cache_file else None
+    if saved and isinstance(saved.get('jars'), dict):
+        cached = saved['jars']
+
+    def stamp(jar):
         try:
-            metadata = str.splitlines(zip.read("META-INF/MANIFEST.MF").decode("utf-8"))
-        except TypeError as e:
-            print(f"ERROR: unable to read META-INF/MANIFEST.MF. See: {e}")
-        for line in metadata:
-            if class_pattern in line:
-                content = line[len(class_pattern):].strip()
-                return {"jar": jar, "main": content}
+            stat = os.stat(jar)
+            return [stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            return None
 
-    return {"jar": jar}
+    def entry_point(jar):
+        key = os.path.abspath(jar)
+        jar_stamp = stamp(jar)
+        entry = cached.get(key)
+        if jar_stamp and isinstance(entry, dict) and entry.get('stamp') == jar_stamp \
+           and 'main' in entry:
+            main = entry['main']
+            return {"jar": jar, "main": main} if main else {"jar": jar}
+        return get_entry_point(jar)
+
+    with concurrent.futures.ThreadPoolExecutor() as pool:
+        entry_points = list(pool.map(entry_point, jars))
+
+    if cache_file:
+        jars_cache = {}
+        for entry in entry_points:
+            jar_stamp = stamp(entry['jar'])
+            if jar_stamp:
+                jars_cache[os.path.abspath(entry['jar'])] = {'stamp': jar_stamp,
+                                                              'main': entry.get('main')}
+        cmdtools.write_json(cache_file, {'version': MANIFEST_CACHE_VERSION, 'jars': jars_cache})
+
+    return entry_points
 
 def ignore_path(path):
     return \
         not path \
         or 'generated-sources' in path
 
-def guess_source(switches):
+def sourcepath_roots(switches):
+    sourcepath = switches.get('sourcepath')
+    if not sourcepath or not isinstance(sourcepath, str):
+        return []
+    return [path for path in sourcepath.split(':')
+            if not ignore_path(path)]
+
+def guess_source(switches, index=None):
     """If no .java files are detected and --guess has been passed on the
     command line, this will attempt to fill in the blanks based on the
     -sourcepath option to javac."""
+    index = index or source_index.SourceIndex()
 
-    sourcepath = switches.get('sourcepath')
     files = []
+    for path in sourcepath_roots(switches):
+        files.extend(index.java_files(path))
 
-    if not sourcepath:
-        return []
-
-    paths = [path for path in sourcepath.split(':')
-             if not ignore_path(path)]
-
-    for path in paths:
-        for dirname, subdirs, dirfiles in os.walk(path):
-            files.extend([os.path.join(dirname, file) for file in dirfiles
-                          if file.endswith('.java')])
-
-    return files
+    # Overlapping -sourcepath entries would list some files twice.
+    return list(dict.fromkeys(files))
 
 class GenericCapture(object):
     def __init__(self, cmd, args):
         self.build_cmd = cmd
         self.args = args
-
-    def get_javac_commands(self, verbose_output):
-        return []
-
-    def get_target_jars(self, verbose_output):
-        return []
+        self.javac_commands = []
+        self.target_jars = []
+        self.classifier = classify.LineClassifier()
+        # The environment to run the build in, if not dljc's own.
+        self.build_env = None
+
+    def parse_line(self, line):
+        """Called once for every line of build output, as the build emits
+        it. By default, the line is dispatched to the handlers subclasses
+        registered with self.classifier, which append to
+        self.javac_commands and self.target_jars."""
+        self.classifier.classify(line)
+
+    def finish_parse(self):
+        """Called once every line of build output has been parsed."""
+        pass
+
+    def parse_output(self, lines):
+        """Parse an iterable of build output lines. Returns the javac
+        commands and target jars found in it."""
+        for line in lines:
+            self.parse_line(line)
+        self.finish_parse()
+        return self.javac_commands, self.target_jars
 
     def capture(self):
-        stats = {}
+        if self.args.from_log:
+            return self.replay(self.args.from_log)
 
-        start_time = timeit.default_timer()
-        result = cmdtools.run_cmd(self.build_cmd, self.args)
-        # stats['build_time'] = result['time']
-        stats['build_time'] = timeit.default_timer() - start_time
+        stats = {}
 
         build_out_file = os.path.join(self.args.output_directory, 'build_output.txt')
         with open(build_out_file, 'w') as f:
-            f.write(result['output'])
-
-        if result['return_code'] != 0:
+            def handle_line(line):
+                f.write(line)
+                f.write('\n')
+                self.parse_line(line)
+
+            start_time = timeit.default_timer()
+            result = cmdtools.run_cmd(self.build_cmd, self.args,
+                                      line_handler=handle_line,
+                                      env=self.build_env)
+            # stats['build_time'] = result['time']
+            stats['build_time'] = timeit.default_timer() - start_time
+
+        if result.get('return_code') != 0:
             return None
 
-        build_lines = result['output'].split('\n')
+        self.finish_parse()
+
+        return self.results(stats)
 
-        javac_commands = self.get_javac_commands(build_lines)
-        target_jars = self.get_target_jars(build_lines)
-        jars_with_entry_points = list(map(get_entry_point, target_jars))
+    def replay(self, build_log):
+        """Capture the javac commands from the saved output of an earlier run
+        of the build, instead of running it."""
+        stats = {'build_time': None, 'build_log': build_log}
+        self.read_replay(build_log)
+        return self.results(stats)
+
+    def read_replay(self, build_log):
+        """Parse build_log, what replay was given. Capturers that record the
+        javac commands somewhere other than the build's output read their
+        records here instead."""
+        self.parse_output(read_build_log(build_log))
+
+    def results(self, stats):
+        javac_commands = self.javac_commands
+        if self.args.guess_source:
+            self.guess_sources(javac_commands)
+        cache_file = None
+        if self.args.output_directory:
+            cache_file = os.path.join(self.args.output_directory, MANIFEST_CACHE_FILE)
+        jars_with_entry_points = get_entry_points(self.target_jars, cache_file)
 
         self.record_stats(stats, javac_commands, jars_with_entry_points)
 
         return [javac_commands, jars_with_entry_points, stats]
 
-    def javac_parse(self, javac_command):
+    def guess_sources(self, javac_commands):
+        """Guess the source files of the javac commands that have none, from
+        one index of all their source paths."""
+        unguessed = [jc for jc in javac_commands if not jc['java_files']]
+        if not unguessed:
+            return
+
+        index_file = None
+        if self.args.output_directory:
+            index_file = os.path.join(self.args.output_directory, source_index.INDEX_FILE)
+        index = source_index.SourceIndex(getattr(self.args, 'guess_ignore', None) or (),
+                                         index_file)
+        index.add_roots(root for jc in unguessed
+                        for root in sourcepath_roots(jc['javac_switches']))
+
+        for jc in unguessed:
+            jc['java_files'] = guess_source(jc['javac_switches'], index)
+
+        index.save()
+
+    def javac_parse(self, javac_command, argfiles=None, cwd=None):
+        """Parse the arguments of a javac command into its source files and
+        switches. @argfiles are expanded; see expand_argfiles."""
         files = []
         switches = {}
 
         prev_arg = None
 
-        for a in javac_command:
+        for a in expand_argfiles(javac_command, argfiles, cwd):
             possible_switch_arg = True
 
             if is_switch(a):
@@ -118,14 +385,13 @@ class GenericCapture(object):
             else:
                 prev_arg = None
 
-        if self.args.guess_source and not files:
-            files = guess_source(switches)
-
         return dict(java_files=files, javac_switches=switches)
 
     def record_stats(self, stats, javac_commands, jars):
         stats['source_files'] = sum([len(cmd['java_files']) for cmd in javac_commands])
+        classdirs = {cmdtools.class_directory(cmd) for cmd in javac_commands} - {None}
         stats['class_files'] = sum([len(cmdtools.get_class_files(cmd)) for cmd in javac_commands])
+        stats['class_bytes'] = sum(cmdtools.class_index(classdir).size() for classdir in classdirs)
         stats['javac_invocations'] = len(javac_commands)
         stats['built_jars'] = len(jars)
         stats['executable_jars'] = len([jar for jar in jars if 'main' in jar])
@@ -6,13 +6,20 @@
 # additional grant of patent rights can be found in the PATENTS_Facebook file
 # in the same directory.
 
+import json
 import os
+import shutil
 
 from . import generic
 
 supported_commands = ['gradle', 'gradlew']
 
+INIT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dljc-init.gradle')
+RECORD_DIR = 'gradle-records'
+
 def gen_instance(cmd, args):
+    if args.capture_mode == 'plugin':
+        return GradleInitScriptCapture(cmd, args)
     return GradleCapture(cmd, args)
 
 class GradleCapture(generic.GenericCapture):
@@ -20,17 +27,55 @@ class GradleCapture(generic.GenericCapture):
         super(GradleCapture, self).__init__(cmd, args)
         self.build_cmd = [cmd[0], '--debug'] + cmd[1:]
 
-        # Automatically promote to gradlew if available
-        if os.path.exists('gradlew'):
-          self.build_cmd[0] = './gradlew'
+        generic.promote_to_wrapper(self.build_cmd, 'gradlew')
+
+        self.classifier.add(' Compiler arguments: ', self.compiler_arguments)
+
+    def compiler_arguments(self, line, match):
+        content = line[match.end():].strip()
+        self.javac_commands.append(self.javac_parse(generic.split_arguments(content)))
+
+def read_records(record_dir):
+    """The records written by dljc-init.gradle into record_dir, in the
+    order their tasks started."""
+    records = []
+    if os.path.isdir(record_dir):
+        for name in os.listdir(record_dir):
+            if name.endswith('.json'):
+                with open(os.path.join(record_dir, name)) as f:
+                    records.append(json.load(f))
+    return sorted(records, key=lambda record: record['started'])
+
+class GradleInitScriptCapture(generic.GenericCapture):
+    """Captures the javac commands of a Gradle build with an init script
+    that records the configuration of each JavaCompile task as it runs.
+    The build runs without --debug, so the daemon, parallel execution and
+    the configuration cache work as usual, and the arguments come from the
+    task rather than from a log line."""
+
+    def __init__(self, cmd, args):
+        super(GradleInitScriptCapture, self).__init__(cmd, args)
+        self.record_dir = os.path.join(args.output_directory, RECORD_DIR)
+        self.build_cmd = [cmd[0], '--init-script', INIT_SCRIPT,
+                          f'-Ddljc.recordDir={self.record_dir}'] + cmd[1:]
+
+        generic.promote_to_wrapper(self.build_cmd, 'gradlew')
+
+    def capture(self):
+        if not self.args.from_log and os.path.isdir(self.record_dir):
+            shutil.rmtree(self.record_dir)
+        return super(GradleInitScriptCapture, self).capture()
 
-    def get_javac_commands(self, verbose_output):
-        argument_start_pattern = ' Compiler arguments: '
-        results = []
+    def finish_parse(self):
+        self.parse_records(read_records(self.record_dir))
 
-        for line in verbose_output:
-            if argument_start_pattern in line:
-                content = line.partition(argument_start_pattern)[2].strip()
-                results.append(content.split(' '))
+    def read_replay(self, build_log):
+        # a directory of records saved from an earlier run of the build
+        self.parse_records(read_records(build_log))
 
-        return list(map(self.javac_parse, results))
+    def parse_records(self, records):
+        for record in records:
+            if 'jar' in record:
+                self.target_jars.append(record['jar'])
+            elif record['sources']:
+                self.javac_commands.append(self.javac_parse(record['args'] + record['sources']))
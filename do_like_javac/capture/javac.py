@@ -19,5 +19,5 @@ class JavaCapture(generic.GenericCapture):
         self.build_cmd = cmd
         self.cmd = cmd[1:]
 
-    def get_javac_commands(self, verbose_output):
-        return list(map(self.javac_parse, [self.cmd]))
+    def finish_parse(self):
+        self.javac_commands.append(self.javac_parse(self.cmd))
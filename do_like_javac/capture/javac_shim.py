@@ -0,0 +1,52 @@
+"""Stands in for javac while a build runs with --capture-mode shim.
+
+Appends the working directory and arguments of the invocation, with the
+contents of any @argfiles (which build tools often delete once javac has
+run), as one JSON line to the file named by DLJC_JAVAC_RECORD, then
+replaces itself with the real javac named by DLJC_REAL_JAVAC.
+
+This file is run as a script by the javac wrapper dljc puts on the PATH,
+so it must not import anything from do_like_javac."""
+
+import json
+import os
+import sys
+
+def read_argfiles(argv):
+    argfiles = {}
+    for arg in argv:
+        if arg.startswith('@') and arg not in argfiles:
+            try:
+                with open(arg[1:], errors='replace') as f:
+                    argfiles[arg] = f.read()
+            except OSError:
+                pass
+    return argfiles
+
+def record(record_file, argv):
+    line = json.dumps({'cwd': os.getcwd(),
+                       'argv': argv,
+                       'argfiles': read_argfiles(argv)}) + '\n'
+    # One write to a file opened for appending, so that the records of
+    # javac processes running at the same time are not interleaved.
+    fd = os.open(record_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode('utf-8'))
+    finally:
+        os.close(fd)
+
+def main():
+    argv = sys.argv[1:]
+    real_javac = os.environ['DLJC_REAL_JAVAC']
+
+    record_file = os.environ.get('DLJC_JAVAC_RECORD')
+    if record_file and argv:
+        try:
+            record(record_file, argv)
+        except OSError as e:
+            sys.stderr.write(f"dljc: could not record javac command: {e}\n")
+
+    os.execv(real_javac, [real_javac] + argv)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import struct
+import zipfile
+import zlib
+
+MANIFEST_NAME = b'META-INF/MANIFEST.MF'
+
+END_OF_CENTRAL_DIRECTORY = b'PK\x05\x06'
+ZIP64_END_LOCATOR = b'PK\x06\x07'
+ZIP64_END_OF_CENTRAL_DIRECTORY = b'PK\x06\x06'
+CENTRAL_DIRECTORY_HEADER = b'PK\x01\x02'
+LOCAL_FILE_HEADER = b'PK\x03\x04'
+
+# Fixed-size parts of the zip records read here, and the largest comment
+# that can follow the end of central directory record.
+END_SIZE = 22
+ZIP64_LOCATOR_SIZE = 20
+ZIP64_END_SIZE = 56
+CENTRAL_SIZE = 46
+LOCAL_SIZE = 30
+MAX_COMMENT = 0xFFFF
+
+# How much of the central directory to read at a time. The manifest is
+# usually its first or second entry.
+CHUNK_SIZE = 64 * 1024
+
+def read_manifest(jar):
+    """The contents of jar's META-INF/MANIFEST.MF, or None if it has none.
+
+    zipfile reads the whole central directory into ZipInfo objects before
+    anything can be looked up, which for a shaded jar is hundreds of
+    thousands of entries. Instead, the central directory is scanned only
+    as far as the manifest's entry, and only that entry is read. Jars this
+    doesn't handle (e.g. with data before the archive) are read with
+    zipfile."""
+    try:
+        with open(jar, 'rb') as f:
+            return scan_manifest(f)
+    except (ValueError, struct.error, zlib.error):
+        pass
+
+    with zipfile.ZipFile(jar, 'r') as zip:
+        try:
+            return zip.read(MANIFEST_NAME.decode())
+        except KeyError:
+            return None
+
+def scan_manifest(f):
+    f.seek(0, 2)
+    size = f.tell()
+    tail_size = min(size, END_SIZE + MAX_COMMENT)
+    f.seek(size - tail_size)
+    tail = f.read(tail_size)
+
+    end = tail.rfind(END_OF_CENTRAL_DIRECTORY)
+    if end < 0 or end + END_SIZE > len(tail):
+        raise ValueError('no end of central directory record')
+    end_offset = size - tail_size + end
+    entries, directory_size, directory_offset = struct.unpack('<HII', tail[end + 10:end + 20])
+
+    if entries == 0xFFFF or directory_size == 0xFFFFFFFF or directory_offset == 0xFFFFFFFF:
+        # More entries, or a bigger archive, than the record can describe:
+        # the real values are in the zip64 end of central directory record.
+        locator = end - ZIP64_LOCATOR_SIZE
+        if locator < 0 or tail[locator:locator + 4] != ZIP64_END_LOCATOR:
+            raise ValueError('no zip64 end of central directory locator')
+        (zip64_end_offset,) = struct.unpack('<Q', tail[locator + 8:locator + 16])
+        f.seek(zip64_end_offset)
+        zip64_end = f.read(ZIP64_END_SIZE)
+        if zip64_end[:4] != ZIP64_END_OF_CENTRAL_DIRECTORY:
+            raise ValueError('bad zip64 end of central directory record')
+        entries, directory_size, directory_offset = struct.unpack('<QQQ', zip64_end[32:56])
+        end_offset = zip64_end_offset
+
+    if directory_offset + directory_size != end_offset:
+        raise ValueError('data before the archive')
+
+    f.seek(directory_offset)
+    buffer = b''
+    # where the current entry starts in buffer; the entries before it are
+    # only dropped when more of the directory is read
+    pos = 0
+
+    def refill(needed):
+        nonlocal buffer, pos
+        buffer = buffer[pos:]
+        pos = 0
+        while len(buffer) < needed:
+            more = f.read(max(CHUNK_SIZE, needed - len(buffer)))
+            if not more:
+                raise ValueError('truncated central directory')
+            buffer += more
+
+    for _ in range(entries):
+        if len(buffer) - pos < CENTRAL_SIZE:
+            refill(CENTRAL_SIZE)
+        if buffer[pos:pos + 4] != CENTRAL_DIRECTORY_HEADER:
+            raise ValueError('bad central directory header')
+        (method, compressed_size, name_length, extra_length, comment_length,
+         local_offset) = struct.unpack_from('<6xH8xI4xHHH8xI', buffer, pos + 4)
+
+        record_size = CENTRAL_SIZE + name_length + extra_length + comment_length
+        if len(buffer) - pos < record_size:
+            refill(record_size)
+
+        name = pos + CENTRAL_SIZE
+        if buffer[name:name + name_length] == MANIFEST_NAME:
+            if compressed_size == 0xFFFFFFFF or local_offset == 0xFFFFFFFF:
+                raise ValueError('zip64 entry')
+            return read_entry(f, local_offset, method, compressed_size)
+        pos += record_size
+
+    return None
+
+def read_entry(f, offset, method, compressed_size):
+    f.seek(offset)
+    header = f.read(LOCAL_SIZE)
+    if header[:4] != LOCAL_FILE_HEADER:
+        raise ValueError('bad local file header')
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    f.seek(offset + LOCAL_SIZE + name_length + extra_length)
+    data = f.read(compressed_size)
+
+    if method == zipfile.ZIP_STORED:
+        return data
+    if method == zipfile.ZIP_DEFLATED:
+        return zlib.decompress(data, -zlib.MAX_WBITS)
+    raise ValueError(f'unsupported compression method {method}')
+
+def main_attributes(manifest):
+    """The attributes in the main section of a manifest, with continuation
+    lines joined."""
+    attributes = {}
+    name = None
+    for line in manifest.decode('utf-8', errors='replace').splitlines():
+        if not line:
+            # the end of the main section
+            break
+        if line.startswith(' ') and name:
+            attributes[name] += line[1:]
+        elif ':' in line:
+            name, value = line.split(':', 1)
+            attributes[name] = value.strip()
+    return attributes
+
+def main_class(jar):
+    manifest = read_manifest(jar)
+    if manifest is None:
+        return None
+    return main_attributes(manifest).get('Main-Class')
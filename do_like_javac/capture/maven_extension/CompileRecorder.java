@@ -0,0 +1,209 @@
+package dljc;
+
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.OutputStream;
+import java.nio.charset.StandardCharsets;
+import java.util.ArrayList;
+import java.util.LinkedHashMap;
+import java.util.List;
+import java.util.Map;
+
+import javax.inject.Named;
+import javax.inject.Singleton;
+
+import org.apache.maven.eventspy.AbstractEventSpy;
+import org.apache.maven.execution.ExecutionEvent;
+import org.apache.maven.execution.MavenSession;
+import org.apache.maven.plugin.MojoExecution;
+import org.apache.maven.plugin.PluginParameterExpressionEvaluator;
+import org.apache.maven.project.MavenProject;
+import org.codehaus.plexus.component.configurator.expression.ExpressionEvaluator;
+import org.codehaus.plexus.util.xml.Xpp3Dom;
+
+/**
+ * Maven core extension used by dljc --capture-mode plugin.
+ *
+ * <p>When a maven-compiler-plugin compile or testCompile goal succeeds, the
+ * configuration it compiled with (output directory, classpath, source roots
+ * and compiler options) is appended as one JSON line to the file named by
+ * the dljc.record property; when a maven-jar-plugin goal succeeds, the jar
+ * it built is. Each record is written with a single synchronized append, so
+ * the records of modules built in parallel (-T) are never interleaved.
+ */
+@Named("dljc")
+@Singleton
+public class CompileRecorder extends AbstractEventSpy {
+  private static final String COMPILER_PLUGIN = "maven-compiler-plugin";
+  private static final String JAR_PLUGIN = "maven-jar-plugin";
+
+  @Override
+  public void onEvent(Object event) throws Exception {
+    if (!(event instanceof ExecutionEvent)) {
+      return;
+    }
+    ExecutionEvent executionEvent = (ExecutionEvent) event;
+    if (executionEvent.getType() != ExecutionEvent.Type.MojoSucceeded) {
+      return;
+    }
+
+    MavenSession session = executionEvent.getSession();
+    String recordFile = session.getUserProperties().getProperty("dljc.record");
+    if (recordFile == null) {
+      return;
+    }
+
+    MojoExecution mojo = executionEvent.getMojoExecution();
+    MavenProject project = executionEvent.getProject();
+    String goal = mojo.getGoal();
+
+    Map<String, Object> record = null;
+    if (COMPILER_PLUGIN.equals(mojo.getArtifactId())
+        && ("compile".equals(goal) || "testCompile".equals(goal))) {
+      record = compileRecord(session, mojo, project, "testCompile".equals(goal));
+    } else if (JAR_PLUGIN.equals(mojo.getArtifactId())
+        && project.getArtifact() != null && project.getArtifact().getFile() != null) {
+      record = new LinkedHashMap<>();
+      record.put("project", project.getId());
+      record.put("jar", project.getArtifact().getFile().getAbsolutePath());
+    }
+
+    if (record != null) {
+      append(recordFile, toJson(record) + "\n");
+    }
+  }
+
+  private static Map<String, Object> compileRecord(
+      MavenSession session, MojoExecution mojo, MavenProject project, boolean test)
+      throws Exception {
+    ExpressionEvaluator evaluator = new PluginParameterExpressionEvaluator(session, mojo);
+    Xpp3Dom config = mojo.getConfiguration();
+
+    if ("true".equals(parameter(evaluator, config, "skip"))) {
+      return null;
+    }
+
+    Map<String, Object> record = new LinkedHashMap<>();
+    record.put("project", project.getId());
+    record.put("goal", mojo.getGoal());
+    if (test) {
+      record.put("outputDirectory", project.getBuild().getTestOutputDirectory());
+      record.put("classpath", project.getTestClasspathElements());
+      record.put("sourceRoots", new ArrayList<>(project.getTestCompileSourceRoots()));
+      record.put("generatedSourcesDirectory",
+          parameter(evaluator, config, "generatedTestSourcesDirectory"));
+    } else {
+      record.put("outputDirectory", project.getBuild().getOutputDirectory());
+      record.put("classpath", project.getCompileClasspathElements());
+      record.put("sourceRoots", new ArrayList<>(project.getCompileSourceRoots()));
+      record.put("generatedSourcesDirectory",
+          parameter(evaluator, config, "generatedSourcesDirectory"));
+    }
+
+    for (String option : new String[] {"source", "target", "release"}) {
+      String value = test ? parameter(evaluator, config, "test" + capitalize(option)) : null;
+      record.put(option, value != null ? value : parameter(evaluator, config, option));
+    }
+    record.put("encoding", parameter(evaluator, config, "encoding"));
+
+    List<String> compilerArgs = new ArrayList<>();
+    Xpp3Dom args = config == null ? null : config.getChild("compilerArgs");
+    if (args != null) {
+      for (Xpp3Dom arg : args.getChildren()) {
+        String value = evaluate(evaluator, arg.getValue());
+        if (value != null) {
+          compilerArgs.add(value);
+        }
+      }
+    }
+    String compilerArgument = parameter(evaluator, config, "compilerArgument");
+    if (compilerArgument != null) {
+      compilerArgs.add(compilerArgument);
+    }
+    record.put("compilerArgs", compilerArgs);
+
+    return record;
+  }
+
+  /** The value of a mojo parameter, with expressions in it evaluated. */
+  private static String parameter(ExpressionEvaluator evaluator, Xpp3Dom config, String name) {
+    Xpp3Dom child = config == null ? null : config.getChild(name);
+    if (child == null) {
+      return null;
+    }
+    String expression = child.getValue() != null ? child.getValue() : child.getAttribute("default-value");
+    return evaluate(evaluator, expression);
+  }
+
+  private static String evaluate(ExpressionEvaluator evaluator, String expression) {
+    if (expression == null) {
+      return null;
+    }
+    try {
+      Object value = evaluator.evaluate(expression);
+      return value == null ? null : value.toString();
+    } catch (Exception e) {
+      return expression;
+    }
+  }
+
+  private static String capitalize(String s) {
+    return Character.toUpperCase(s.charAt(0)) + s.substring(1);
+  }
+
+  private static synchronized void append(String file, String line) throws IOException {
+    try (OutputStream out = new FileOutputStream(file, true)) {
+      out.write(line.getBytes(StandardCharsets.UTF_8));
+    }
+  }
+
+  private static String toJson(Object value) {
+    StringBuilder json = new StringBuilder();
+    writeJson(json, value);
+    return json.toString();
+  }
+
+  private static void writeJson(StringBuilder json, Object value) {
+    if (value == null) {
+      json.append("null");
+    } else if (value instanceof Map) {
+      json.append('{');
+      String separator = "";
+      for (Map.Entry<?, ?> entry : ((Map<?, ?>) value).entrySet()) {
+        json.append(separator);
+        writeJson(json, entry.getKey().toString());
+        json.append(':');
+        writeJson(json, entry.getValue());
+        separator = ",";
+      }
+      json.append('}');
+    } else if (value instanceof Iterable) {
+      json.append('[');
+      String separator = "";
+      for (Object element : (Iterable<?>) value) {
+        json.append(separator);
+        writeJson(json, element);
+        separator = ",";
+      }
+      json.append(']');
+    } else {
+      json.append('"');
+      for (char c : value.toString().toCharArray()) {
+        switch (c) {
+          case '"': json.append("\\\""); break;
+          case '\\': json.append("\\\\"); break;
+          case '\n': json.append("\\n"); break;
+          case '\r': json.append("\\r"); break;
+          case '\t': json.append("\\t"); break;
+          default:
+            if (c < 0x20) {
+              json.append(String.format("\\u%04x", (int) c));
+            } else {
+              json.append(c);
+            }
+        }
+      }
+      json.append('"');
+    }
+  }
+}
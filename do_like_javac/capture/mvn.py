@@ -6,14 +6,33 @@
 # additional grant of patent rights can be found in the PATENTS_Facebook file
 # in the same directory.
 
+import hashlib
 import os
 import re
+import shutil
+import subprocess
+import tempfile
+import zipfile
+
+import do_like_javac.tools.common as cmdtools
 
 from . import generic
 
 supported_commands = ['mvn', 'mvnw']
 
+stale_file_pattern = re.compile(r'([^ ]*\.java)')
+
+EXTENSION_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'maven_extension', 'CompileRecorder.java')
+EXTENSION_CLASS = 'dljc.CompileRecorder'
+EXTENSION_DIR = 'maven-extension'
+RECORD_FILE = 'maven-record.jsonl'
+
+maven_home_pattern = re.compile(r'^Maven home: (.*)$', re.MULTILINE)
+
 def gen_instance(cmd, args):
+    if args.capture_mode == 'plugin':
+        return MavenExtensionCapture(cmd, args)
     return MavenCapture(cmd, args)
 
 class MavenCapture(generic.GenericCapture):
@@ -21,44 +40,147 @@ class MavenCapture(generic.GenericCapture):
         super(MavenCapture, self).__init__(cmd, args)
         self.build_cmd = [cmd[0], '-X', '-B'] + cmd[1:]
 
-        # Automatically promote to mvnw if available
-        if os.path.exists('mvnw'):
-          self.build_cmd[0] = './mvnw'
-
-    def get_target_jars(self, verbose_output):
-        jar_pattern = '[INFO] Building jar: '
-        jars = []
-
-        for line in verbose_output:
-            if jar_pattern in line:
-                pos = line.index(jar_pattern) + len(jar_pattern)
-                jar = line[pos:].strip()
-                jars.append(jar)
-
-        return jars
-
-    def get_javac_commands(self, verbose_output):
-        file_pattern = r'\[DEBUG\] Stale source detected: ([^ ]*\.java)'
-        options_pattern = '[DEBUG] Command line options:'
-
-        javac_commands = []
-        files_to_compile = []
-        options_next = False
-
-        for line in verbose_output:
-            if options_next:
-                #  line has format [Debug] <space separated options>
-                javac_args = line.split(' ')[1:] + files_to_compile
-                javac_commands.append(javac_args)
-                options_next = False
-                files_to_compile = []
-            elif options_pattern in line:
-                #  Next line will have javac options to run
-                options_next = True
+        generic.promote_to_wrapper(self.build_cmd, 'mvnw')
+
+        self.files_to_compile = []
+
+        self.classifier.add('[DEBUG] Stale source detected: ', self.stale_source)
+        self.classifier.add('[DEBUG] Command line options:', self.command_line_options)
+        self.classifier.add('[INFO] Building jar: ', self.target_jar)
+
+    def stale_source(self, line, match):
+        if match.start() == 0:
+            found = stale_file_pattern.match(line, match.end())
+            if found:
+                self.files_to_compile.append(found.group(1))
+
+    def command_line_options(self, line, match):
+        #  Next line will have javac options to run
+        self.classifier.claim_next_line(self.javac_options)
+
+    def javac_options(self, line, match):
+        #  line has format [Debug] <space separated options>
+        javac_args = generic.split_arguments(line)[1:] + self.files_to_compile
+        self.javac_commands.append(self.javac_parse(javac_args))
+        self.files_to_compile = []
+
+    def target_jar(self, line, match):
+        self.target_jars.append(line[match.end():].strip())
+
+def maven_home(mvn):
+    """The installation directory of the Maven that mvn runs, which for
+    mvnw is one the wrapper downloaded."""
+    output = subprocess.run([mvn, '--version'], stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT).stdout.decode('utf-8', errors='replace')
+    found = maven_home_pattern.search(output)
+    if not found:
+        raise ValueError(f"could not find the Maven home directory in the output of {mvn} --version:\n{output}")
+    return found.group(1).strip()
+
+def java_compiler():
+    java_home = os.environ.get('JAVA_HOME')
+    if java_home and os.path.isfile(os.path.join(java_home, 'bin', 'javac')):
+        return os.path.join(java_home, 'bin', 'javac')
+    javac = shutil.which('javac')
+    if not javac:
+        raise ValueError("--capture-mode plugin requires javac to build the Maven extension")
+    return javac
+
+def build_extension(mvn, extension_dir):
+    """Compile CompileRecorder.java against the Maven that mvn runs and
+    package it as an extension jar in extension_dir. The jar is reused
+    while the source and the Maven installation stay the same."""
+    home = maven_home(mvn)
+    with open(EXTENSION_SOURCE, 'rb') as f:
+        digest = hashlib.sha256(f.read() + home.encode('utf-8')).hexdigest()[:16]
+    jar = os.path.join(extension_dir, f'dljc-maven-extension-{digest}.jar')
+    if os.path.exists(jar):
+        return jar
+
+    os.makedirs(extension_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=extension_dir) as classes:
+        result = subprocess.run([java_compiler(), '-source', '1.8', '-target', '1.8', '-nowarn',
+                                 '-classpath', os.path.join(home, 'lib', '*'),
+                                 '-d', classes, EXTENSION_SOURCE],
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        if result.returncode != 0:
+            raise ValueError("could not compile the Maven extension:\n" +
+                             result.stdout.decode('utf-8', errors='replace'))
+
+        with cmdtools.atomic_write(jar, 'wb') as f, zipfile.ZipFile(f, 'w') as out:
+            for dirname, subdirs, files in os.walk(classes):
+                for file in files:
+                    path = os.path.join(dirname, file)
+                    out.write(path, os.path.relpath(path, classes))
+            # The index through which Maven's dependency injection container
+            # finds the @Named event spy.
+            out.writestr('META-INF/sisu/javax.inject.Named', EXTENSION_CLASS + '\n')
+
+    return jar
+
+def java_files(roots):
+    files = []
+    for root in roots:
+        for dirname, subdirs, dirfiles in os.walk(root):
+            files.extend(os.path.join(dirname, file) for file in sorted(dirfiles)
+                         if file.endswith('.java'))
+    return files
+
+class MavenExtensionCapture(generic.GenericCapture):
+    """Captures the javac commands of a Maven build with a core extension
+    that records the compiler configuration of each module as its compile
+    goals finish. The build runs without -X, and the records do not depend
+    on the order of log lines, so parallel builds (-T) work."""
+
+    def __init__(self, cmd, args):
+        super(MavenExtensionCapture, self).__init__(cmd, args)
+        self.record_file = os.path.join(args.output_directory, RECORD_FILE)
+        self.build_cmd = [cmd[0], '-B'] + cmd[1:]
+
+        generic.promote_to_wrapper(self.build_cmd, 'mvnw')
+
+    def capture(self):
+        if not self.args.from_log:
+            extension = build_extension(self.build_cmd[0],
+                                        os.path.join(self.args.output_directory, EXTENSION_DIR))
+            self.build_cmd[1:1] = [f'-Dmaven.ext.class.path={extension}',
+                                   f'-Ddljc.record={self.record_file}']
+            if os.path.exists(self.record_file):
+                os.remove(self.record_file)
+        return super(MavenExtensionCapture, self).capture()
+
+    def finish_parse(self):
+        self.parse_records(generic.read_records(self.record_file))
+
+    def read_replay(self, build_log):
+        # a record file saved from an earlier run of the build
+        self.parse_records(generic.read_records(build_log))
+
+    def parse_records(self, records):
+        for record in records:
+            if 'jar' in record:
+                self.target_jars.append(record['jar'])
+                continue
+
+            generated = record.get('generatedSourcesDirectory')
+            roots = [root for root in record['sourceRoots']
+                     if os.path.isdir(root) and root != generated]
+            files = java_files(roots)
+            if not files:
+                continue
 
+            javac_args = ['-d', record['outputDirectory'],
+                          '-classpath', os.pathsep.join(record['classpath']),
+                          '-sourcepath', os.pathsep.join(roots)]
+            if record.get('release'):
+                javac_args += ['--release', record['release']]
             else:
-                found = re.match(file_pattern, line)
-                if found:
-                    files_to_compile.append(found.group(1))
+                for option in ('source', 'target'):
+                    if record.get(option):
+                        javac_args += ['-' + option, record[option]]
+            if record.get('encoding'):
+                javac_args += ['-encoding', record['encoding']]
+            if generated:
+                javac_args += ['-s', generated]
 
-        return list(map(self.javac_parse, javac_commands))
+            self.javac_commands.append(self.javac_parse(javac_args + record['compilerArgs'] + files))
@@ -0,0 +1,109 @@
+import os
+import shlex
+import shutil
+import stat
+import sys
+
+from . import generic, mvn
+
+# Used for every build command when --capture-mode shim is passed, rather
+# than being chosen by name.
+supported_commands = []
+
+SHIM_DIR = 'javac-shim'
+RECORD_FILE = 'javac-record.jsonl'
+
+# Switches whose argument is a path, or a list of paths, that javac
+# resolves against its working directory.
+DIR_SWITCHES = ('d', 's', 'h')
+PATH_SWITCHES = ('classpath', 'cp', 'sourcepath', 'processorpath', 'bootclasspath')
+
+def gen_instance(cmd, args):
+    return ShimCapture(cmd, args)
+
+def real_javac():
+    javac = shutil.which('javac')
+    if not javac:
+        raise ValueError("--capture-mode shim requires javac on the PATH")
+    return os.path.realpath(javac)
+
+def write_wrapper(shim_dir):
+    """Write a javac executable into shim_dir that runs javac_shim.py."""
+    os.makedirs(shim_dir, exist_ok=True)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'javac_shim.py')
+    wrapper = os.path.join(shim_dir, 'javac')
+    with open(wrapper, 'w') as f:
+        f.write('#!/bin/sh\n')
+        f.write(f'exec {shlex.quote(sys.executable)} {shlex.quote(script)} "$@"\n')
+    os.chmod(wrapper, os.stat(wrapper).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return wrapper
+
+class ShimCapture(generic.GenericCapture):
+    """Captures the javac commands of any build by putting a javac on the
+    PATH that records its arguments before running the real javac. The
+    build runs without any extra logging, but compilations it runs inside
+    its own JVM, rather than by running javac, are not seen."""
+
+    def __init__(self, cmd, args):
+        super(ShimCapture, self).__init__(cmd, args)
+        self.build_cmd = list(cmd)
+        self.record_file = os.path.join(args.output_directory, RECORD_FILE)
+
+    def capture(self):
+        if self.args.from_log:
+            return super(ShimCapture, self).capture()
+
+        shim_dir = os.path.join(self.args.output_directory, SHIM_DIR)
+        javac = real_javac()
+        wrapper = write_wrapper(shim_dir)
+
+        if os.path.basename(self.build_cmd[0]) in mvn.supported_commands:
+            # Maven compiles in-process unless told to fork, and then runs
+            # the javac of the JDK it runs on rather than the one on the PATH.
+            self.build_cmd[1:1] = ['-Dmaven.compiler.fork=true',
+                                   f'-Dmaven.compiler.executable={wrapper}']
+
+        if os.path.exists(self.record_file):
+            os.remove(self.record_file)
+
+        self.build_env = dict(os.environ,
+                              PATH=shim_dir + os.pathsep + os.environ.get('PATH', ''),
+                              DLJC_REAL_JAVAC=javac,
+                              DLJC_JAVAC_RECORD=self.record_file)
+
+        return super(ShimCapture, self).capture()
+
+    def finish_parse(self):
+        self.parse_records(generic.read_records(self.record_file))
+
+    def read_replay(self, build_log):
+        # a record file saved from an earlier run of the build
+        self.parse_records(generic.read_records(build_log))
+
+    def parse_records(self, records):
+        for record in records:
+            javac_command = self.javac_parse(record['argv'], record['argfiles'], record['cwd'])
+            # Build tools also run javac to find out its version and the
+            # like; those invocations compile nothing. With --guess, commands
+            # with only a -sourcepath are kept to guess their sources from.
+            guessable = self.args.guess_source and 'sourcepath' in javac_command['javac_switches']
+            if javac_command['java_files'] or guessable:
+                self.javac_commands.append(absolute_paths(javac_command, record['cwd']))
+
+def absolute_paths(javac_command, cwd):
+    """Resolve the relative paths in javac_command against cwd, the
+    directory javac ran in, which need not be the one dljc runs in."""
+    def resolve(path):
+        return os.path.normpath(os.path.join(cwd, path))
+
+    javac_command['java_files'] = [resolve(f) for f in javac_command['java_files']]
+
+    switches = javac_command['javac_switches']
+    for switch in DIR_SWITCHES:
+        if isinstance(switches.get(switch), str):
+            switches[switch] = resolve(switches[switch])
+    for switch in PATH_SWITCHES:
+        if isinstance(switches.get(switch), str):
+            switches[switch] = os.pathsep.join(resolve(path) if path else path
+                                               for path in switches[switch].split(os.pathsep))
+    return javac_command
@@ -0,0 +1,102 @@
+import concurrent.futures
+import fnmatch
+import os
+
+import do_like_javac.tools.common as cmdtools
+
+# The format of the index file (see common.load_json).
+INDEX_VERSION = 1
+INDEX_FILE = 'dljc-source-index.json'
+
+class SourceIndex(object):
+    """An index of the .java files under the directories that sources are
+    guessed from, shared by every javac command in a run. Each directory
+    is listed once, however many -sourcepath entries it is under, and the
+    roots are walked in parallel.
+
+    For each directory, the index holds its modification time, the .java
+    files in it and its subdirectories. It is saved to index_file, and a
+    directory whose modification time is unchanged in a later run is not
+    listed again. Files and directories whose paths match one of the
+    ignore globs are left out."""
+
+    def __init__(self, ignore=(), index_file=None):
+        self.ignore = sorted(ignore)
+        self.index_file = index_file
+        self.dirs = {}
+        self.previous = {}
+
+        saved = cmdtools.load_json(index_file, INDEX_VERSION) if index_file else None
+        if saved and saved.get('ignore') == self.ignore and isinstance(saved.get('dirs'), dict):
+            self.previous = saved['dirs']
+
+    def ignored(self, path):
+        return any(fnmatch.fnmatch(path, pattern) for pattern in self.ignore)
+
+    def add_roots(self, roots):
+        """Index the directories under each of roots, in parallel."""
+        roots = sorted({os.path.abspath(root) for root in roots} - set(self.dirs))
+        if not roots:
+            return
+        with concurrent.futures.ThreadPoolExecutor() as pool:
+            list(pool.map(self.walk, roots))
+
+    def walk(self, root):
+        pending = [root]
+        while pending:
+            directory = pending.pop()
+            if directory in self.dirs:
+                # already indexed under another root
+                continue
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+
+            entry = self.previous.get(directory)
+            if not entry or entry['mtime'] != mtime:
+                entry = self.list_directory(directory, mtime)
+            self.dirs[directory] = entry
+            pending.extend(os.path.join(directory, subdir) for subdir in entry['subdirs'])
+
+    def list_directory(self, directory, mtime):
+        files = []
+        subdirs = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if self.ignored(entry.path):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    elif entry.name.endswith('.java'):
+                        files.append(entry.name)
+        except OSError:
+            pass
+        return {'mtime': mtime, 'files': sorted(files), 'subdirs': sorted(subdirs)}
+
+    def java_files(self, root):
+        """The .java files under root, as paths starting with root."""
+        directory = os.path.abspath(root)
+        if directory not in self.dirs:
+            self.add_roots([root])
+
+        files = []
+        pending = [(directory, root)]
+        while pending:
+            directory, path = pending.pop()
+            entry = self.dirs.get(directory)
+            if not entry:
+                continue
+            files.extend(os.path.join(path, file) for file in entry['files'])
+            pending.extend((os.path.join(directory, subdir), os.path.join(path, subdir))
+                           for subdir in reversed(entry['subdirs']))
+        return files
+
+    def save(self):
+        """Save the directories indexed in this run for the next one."""
+        if not self.index_file:
+            return
+        cmdtools.write_json(self.index_file, {'version': INDEX_VERSION,
+                                              'ignore': self.ignore,
+                                              'dirs': self.dirs})
@@ -1,5 +1,5 @@
 # import soot
-from . import (bixie, check, chicory, dyntrace, dyntracecounts, graphtools,
+from . import (bixie, check, chicory, common, dyntrace, dyntracecounts, graphtools,
                infer, jprint, randoop, wpi)
 
 TOOLS = {
@@ -33,3 +33,4 @@ def run(args, javac_commands, jars):
   if args.tool:
     for tool in parse_tools(args.tool):
       TOOLS[tool].run(args, javac_commands, jars)
+    common.write_resource_report(args)
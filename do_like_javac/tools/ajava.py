@@ -0,0 +1,136 @@
+import collections
+import hashlib
+import os
+import re
+import shutil
+
+# An annotation, with its arguments if they contain no nested parentheses.
+annotation_pattern = re.compile(r'@(?!interface\b)[A-Za-z_$][\w$.]*(?:\([^()]*\))?')
+
+def digest(files):
+  """A hash of a whole manifest, equal for equal sets of ajava files."""
+  return hashlib.sha256(repr(sorted(files.items())).encode('utf-8')).hexdigest()
+
+def compare(old_dir, old_manifest, new_dir, new_manifest):
+  """Describe how the ajava files in new_dir differ from those in old_dir,
+  given their manifests: which files were added, changed or removed, and
+  how many annotations were added or removed across them."""
+  added = sorted(set(new_manifest) - set(old_manifest))
+  removed = sorted(set(old_manifest) - set(new_manifest))
+  changed = sorted(path for path in set(old_manifest) & set(new_manifest)
+                   if old_manifest[path] != new_manifest[path])
+
+  annotations_changed = 0
+  for path in added:
+    annotations_changed += sum(annotations(os.path.join(new_dir, path)).values())
+  for path in removed:
+    annotations_changed += sum(annotations(os.path.join(old_dir, path)).values())
+  for path in changed:
+    old = annotations(os.path.join(old_dir, path))
+    new = annotations(os.path.join(new_dir, path))
+    annotations_changed += sum(((old - new) + (new - old)).values())
+
+  return {'added': added,
+          'changed': changed,
+          'removed': removed,
+          'annotations_changed': annotations_changed}
+
+def changed_files(changes):
+  return changes['added'] + changes['changed'] + changes['removed']
+
+def annotations(path):
+  """Count the occurrences of each annotation in the file at path."""
+  with open(path, errors='replace') as f:
+    return collections.Counter(annotation_pattern.findall(f.read()))
+
+def summary(changes):
+  return (f"{len(changes['added'])} added, {len(changes['changed'])} changed, "
+          f"{len(changes['removed'])} removed ajava files; "
+          f"{changes['annotations_changed']} annotations changed")
+
+def file_hash(path):
+  with open(path, 'rb') as f:
+    return hashlib.sha256(f.read()).hexdigest()
+
+class IterationStore(object):
+  """Stores the ajava files of each WPI iteration in root/iterationN. Each
+  distinct file is stored once, in root/objects, and hard-linked into every
+  iteration that contains it, so an iteration that changes few files takes
+  up little extra space."""
+
+  def __init__(self, root):
+    self.root = root
+    self.objects_dir = os.path.join(root, 'objects')
+    self.iterations = []
+
+  def add_iteration(self, src, base=None):
+    """Move the files under src into a new iteration directory. Files that
+    are in base, the manifest of an earlier iteration, but not under src are
+    added too. Returns the new directory and its manifest, which maps the
+    relative path of each file to its SHA-256."""
+    directory = os.path.join(self.root, f"iteration{len(self.iterations)}")
+    os.makedirs(directory)
+
+    files = {}
+    for dirname, subdirs, filenames in os.walk(src):
+      for filename in filenames:
+        path = os.path.join(dirname, filename)
+        files[os.path.relpath(path, src)] = self.store(path)
+    for path, sha in (base or {}).items():
+      files.setdefault(path, sha)
+
+    for path, sha in files.items():
+      target = os.path.join(directory, path)
+      os.makedirs(os.path.dirname(target), exist_ok=True)
+      try:
+        os.link(self.object_file(sha), target)
+      except OSError:
+        # the file system does not support hard links
+        shutil.copyfile(self.object_file(sha), target)
+
+    self.iterations.append(directory)
+    return directory, files
+
+  def object_file(self, sha):
+    return os.path.join(self.objects_dir, sha[:2], sha)
+
+  def store(self, path):
+    """Move the file at path into the object store, unless it already holds
+    a file with the same contents. Returns the file's SHA-256."""
+    sha = file_hash(path)
+    object_file = self.object_file(sha)
+    if os.path.exists(object_file):
+      os.remove(path)
+    else:
+      os.makedirs(os.path.dirname(object_file), exist_ok=True)
+      shutil.move(path, object_file)
+    return sha
+
+  def retain(self, keep):
+    """Delete every iteration whose number is not in keep, and the stored
+    files no iteration links to any more."""
+    for number, directory in enumerate(self.iterations):
+      if number not in keep and os.path.isdir(directory):
+        shutil.rmtree(directory)
+
+    for dirname, subdirs, filenames in os.walk(self.objects_dir):
+      for filename in filenames:
+        path = os.path.join(dirname, filename)
+        if os.stat(path).st_nlink == 1:
+          os.remove(path)
+
+  def disk_usage(self):
+    """The total size of the files in the remaining iterations, and the
+    space they take up in the object store."""
+    logical = 0
+    for directory in self.iterations:
+      for dirname, subdirs, filenames in os.walk(directory):
+        logical += sum(os.path.getsize(os.path.join(dirname, f)) for f in filenames)
+
+    stored = 0
+    for dirname, subdirs, filenames in os.walk(self.objects_dir):
+      stored += sum(os.path.getsize(os.path.join(dirname, f)) for f in filenames)
+
+    return {'iterations_kept': sum(map(os.path.isdir, self.iterations)),
+            'ajava_bytes': logical,
+            'stored_bytes': stored}
@@ -12,9 +12,7 @@ def run(args, javac_commands, jars):
                   "-jar", bixie_jar,
                   "-html", os.path.join(args.output_directory, 'bixie_report')]
 
-  i = 1
-
-  for jc in javac_commands:
+  def bixie(i, jc):
     cmd = copy.copy(base_command)
 
     if common.classpath(jc):
@@ -30,4 +28,5 @@ def run(args, javac_commands, jars):
     cmd.extend(['-o', os.path.join(args.output_directory, out_filename)])
 
     common.run_cmd(cmd, args, 'bixie')
-    i = i + 1
+
+  common.run_jobs(args, javac_commands, bixie, 'bixie')
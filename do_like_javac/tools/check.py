@@ -1,7 +1,7 @@
 import os
 import pprint
 
-from . import common
+from . import common, compile_server
 
 argparser = None
 
@@ -60,8 +60,9 @@ def run(args, javac_commands, jars):
                            "-Aajava=" + str(args.ajava)]
 
     checker_command += getArgumentsByVersion(args.jdkVersion)
+    server = compile_server.start(args, checker_command)
 
-    for jc in javac_commands:
+    def check(i, jc):
         ## What is the point of this pprint command, whose result is not used?
         pprint.pformat(jc)
         javac_switches = jc['javac_switches']
@@ -76,8 +77,14 @@ def run(args, javac_commands, jars):
         if args.lib_dir:
             cp += pp + args.lib_dir + ':'
         java_files = jc['java_files']
-        cmd = checker_command + ["-classpath", cp] + java_files
-        common.run_cmd(cmd, args, 'check')
+        cmd = common.with_checker_heap(jc, checker_command + ["-classpath", cp] + java_files)
+        common.run_cmd(compile_server.command(server, cmd), args, 'check',
+                       heap=compile_server.client_heap(server, jc, cmd))
+
+    try:
+        common.run_jobs(args, javac_commands, check, 'check')
+    finally:
+        compile_server.stop(server)
 
 ## other_args is other command-line arguments to javac
 def getArgumentsByVersion(jdkVersion, other_args=[]):
@@ -1,15 +1,222 @@
+import collections
+import concurrent.futures
+import contextlib
+import glob
+import heapq
+import json
 import os
+import re
 import subprocess
 import sys
+import threading
 import timeit
 import traceback
 
+from . import incremental
+
+# The index of the job (see run_jobs) the current thread is running, if any.
+current_job = threading.local()
+
+def log_file(args, tool):
+  """The log file for tool. Each job started by run_jobs logs to its own
+  file, which is merged into the tool's log once all jobs have finished."""
+  index = getattr(current_job, 'index', None)
+  if index is None:
+    return os.path.join(args.output_directory, f"{tool}-stdout.log")
+  return os.path.join(args.output_directory, f"{tool}-stdout.job{index}.log")
 
 def log(args, tool, message):
-  with open(os.path.join(args.output_directory, f"{tool}-stdout.log"), 'a') as f:
+  with open(log_file(args, tool), 'a') as f:
     f.write(message)
     f.flush()
 
+@contextlib.contextmanager
+def atomic_write(filename, mode='w'):
+  """Open a temporary file next to filename for the with block to write,
+  and replace filename with it once the block finishes, so that no reader
+  (or later run) ever sees a partly written file. If the block raises,
+  filename is left as it was."""
+  directory = os.path.dirname(filename)
+  if directory:
+    os.makedirs(directory, exist_ok=True)
+  partial = filename + '.tmp'
+  try:
+    with open(partial, mode) as f:
+      yield f
+  except BaseException:
+    if os.path.exists(partial):
+      os.remove(partial)
+    raise
+  os.replace(partial, filename)
+
+def write_json(filename, obj, **options):
+  with atomic_write(filename) as f:
+    json.dump(obj, f, **options)
+
+def load_json(filename, version):
+  """The JSON object in filename, if it can be read and its 'version' is
+  version, else None. Each kind of file dljc keeps between runs has a
+  version, which must be bumped whenever the format of the file changes,
+  so that files in the old format are ignored rather than misread."""
+  try:
+    with open(filename) as f:
+      obj = json.load(f)
+  except (OSError, ValueError):
+    return None
+  if not isinstance(obj, dict) or obj.get('version') != version:
+    return None
+  return obj
+
+size_pattern = re.compile(r'^(\d+)([kmgt]?)b?$', re.IGNORECASE)
+SIZE_UNITS = {'': 1, 'k': 2**10, 'm': 2**20, 'g': 2**30, 't': 2**40}
+
+def parse_size(size):
+  """The number of bytes in a size such as 512M or 4g, as given to -Xmx."""
+  found = size_pattern.match(size.strip())
+  if not found:
+    raise ValueError(f"invalid size: {size}")
+  return int(found.group(1)) * SIZE_UNITS[found.group(2).lower()]
+
+def physical_memory():
+  try:
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+  except (ValueError, OSError, AttributeError):
+    return None
+
+JVM_LAUNCHERS = ('java', 'javac')
+
+def explicit_heap(cmd):
+  """The -Xmx (or javac's -J-Xmx) in cmd, in bytes, if any."""
+  for arg in reversed(cmd):
+    for prefix in ('-Xmx', '-J-Xmx'):
+      if arg.startswith(prefix):
+        return parse_size(arg[len(prefix):])
+  return None
+
+def jvm_heap(cmd):
+  """The maximum heap of the JVM run by cmd: its -Xmx (or javac's
+  -J-Xmx), or else the JVM's default of a quarter of physical memory.
+  Commands that don't start a JVM take none."""
+  heap = explicit_heap(cmd)
+  if heap is not None:
+    return heap
+  if not cmd or os.path.basename(cmd[0]) not in JVM_LAUNCHERS:
+    return 0
+  memory = physical_memory()
+  return memory // 4 if memory else 0
+
+def scaled_heap(count, base, per_item, maximum):
+  """A heap for a JVM that processes count classes or source files: base
+  bytes, plus per_item bytes for each of them, up to maximum."""
+  return min(base + per_item * count, maximum)
+
+# The expected heap of javac running a Checker Framework checker on a
+# module, by its number of source files (see scaled_heap).
+CHECKER_HEAP = (512 * 2**20, 2 * 2**20, 8 * 2**30)
+
+def checker_heap(javac_command, cmd):
+  """The heap to admit cmd, which runs a checker on javac_command, with:
+  the -J-Xmx it was given, or else one scaled to the module's size."""
+  heap = explicit_heap(cmd)
+  if heap is None:
+    heap = scaled_heap(len(javac_command.get('java_files', [])), *CHECKER_HEAP)
+  return heap
+
+def heap_size(heap):
+  """heap, in bytes, as an argument to -Xmx."""
+  return f"{max(heap // 2**20, 1)}m"
+
+def with_heap(cmd, heap):
+  """cmd with the maximum heap of its JVM set to heap bytes (with -J-Xmx
+  for javac, -Xmx otherwise), unless it already sets one. Without it, the
+  JVM would take a quarter of physical memory, whatever the budget was
+  charged."""
+  if explicit_heap(cmd) is not None:
+    return cmd
+  option = '-J-Xmx' if os.path.basename(cmd[0]) == 'javac' else '-Xmx'
+  return cmd[:1] + [option + heap_size(heap)] + cmd[1:]
+
+def with_checker_heap(javac_command, cmd):
+  """cmd, which runs a checker on javac_command, with the heap that
+  checker_heap admits it with."""
+  return with_heap(cmd, checker_heap(javac_command, cmd))
+
+class ResourceBudget(object):
+  """The memory and cores available to the subprocesses dljc runs at once.
+
+  reserve() blocks until the memory and cores asked for are free, and
+  holds them until the with block it guards exits. Requests are granted in
+  the order they are made, so a large one is not starved by smaller ones
+  that keep fitting in ahead of it; a request for more than the whole
+  budget is granted once nothing else holds any of it."""
+
+  def __init__(self, memory, cpus):
+    self.memory = memory
+    self.cpus = cpus
+    self.free_memory = memory
+    self.free_cpus = cpus
+    self.waiting = collections.deque()
+    self.condition = threading.Condition()
+    self.queue_times = {}
+
+  @contextlib.contextmanager
+  def reserve(self, memory, cpus=1, tool=None):
+    """Reserve memory bytes and cpus cores. The with statement gets the
+    number of seconds spent waiting for them, which are also added up for
+    tool in self.queue_times."""
+    memory = min(memory, self.memory)
+    cpus = min(cpus, self.cpus)
+    ticket = object()
+    start_time = timeit.default_timer()
+
+    with self.condition:
+      self.waiting.append(ticket)
+      self.condition.wait_for(lambda: self.waiting[0] is ticket and
+                              self.free_memory >= memory and self.free_cpus >= cpus)
+      self.waiting.popleft()
+      self.free_memory -= memory
+      self.free_cpus -= cpus
+      self.condition.notify_all()
+
+      queue_time = timeit.default_timer() - start_time
+      times = self.queue_times.setdefault(tool, {'commands': 0, 'queue_time': 0.0, 'max_queue_time': 0.0})
+      times['commands'] += 1
+      times['queue_time'] += queue_time
+      times['max_queue_time'] = max(times['max_queue_time'], queue_time)
+
+    try:
+      yield queue_time
+    finally:
+      with self.condition:
+        self.free_memory += memory
+        self.free_cpus += cpus
+        self.condition.notify_all()
+
+budget_lock = threading.Lock()
+run_budget = None
+
+def budget(args):
+  """The ResourceBudget shared by every tool in this run, limited by
+  --memory-limit and --cpu-limit."""
+  global run_budget
+  with budget_lock:
+    if run_budget is None:
+      memory = getattr(args, 'memory_limit', None) or physical_memory()
+      cpus = getattr(args, 'cpu_limit', None) or os.cpu_count() or 1
+      run_budget = ResourceBudget(memory or float('inf'), cpus)
+    return run_budget
+
+def write_resource_report(args):
+  """Write the time the commands of each tool spent waiting for memory and
+  cores to resources.json in the output directory."""
+  if run_budget is None:
+    return
+  memory = run_budget.memory
+  with open(os.path.join(args.output_directory, 'resources.json'), 'w') as f:
+    json.dump({'memory_limit': memory if memory != float('inf') else None,
+               'cpu_limit': run_budget.cpus,
+               'tools': run_budget.queue_times}, f, indent=4, sort_keys=True)
+
 def classpath(javac_command):
   if 'javac_switches' in javac_command:
     switches = javac_command['javac_switches']
@@ -26,24 +233,76 @@ def class_directory(javac_command):
       return switches['d']
   return None
 
-def get_class_files(javac_command):
-  classes = []
-  classdir = class_directory(javac_command)
+class ClassIndex(object):
+  """The class files under a -d directory, listed once with os.scandir.
+  For each package (the directory, relative to the -d directory, of some
+  class files), in the order a top-down walk reaches them, holds the
+  names and sizes of its class files. mtime is the latest modification
+  time of any of them."""
 
-  if classdir:
-    for root, dirs, files in os.walk(classdir):
-      classes.extend([os.path.join(root,file)
-                      for file in files if '.class' in file])
+  def __init__(self, classdir):
+    self.packages = {}
+    self.mtime = 0
+    pending = ['']
+    while pending:
+      package = pending.pop()
+      subdirs = []
+      classes = []
+      try:
+        with os.scandir(os.path.join(classdir, package)) as entries:
+          for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+              subdirs.append(entry.name)
+            elif entry.name.endswith('.class'):
+              stat = entry.stat()
+              classes.append((entry.name, stat.st_size))
+              self.mtime = max(self.mtime, stat.st_mtime_ns)
+      except OSError:
+        continue
+      if classes:
+        self.packages[package] = sorted(classes)
+      pending.extend(os.path.join(package, subdir) for subdir in sorted(subdirs, reverse=True))
 
-  return classes
+  def class_files(self):
+    """The paths of the class files, relative to the -d directory."""
+    return [os.path.join(package, name)
+            for package, classes in self.packages.items()
+            for name, size in classes]
 
-def get_classes(javac_command):
-  def class_file_to_class_name(classdir, class_file):
-    return class_file.replace(classdir + "/", '').replace('.class','').replace('/','.')
+  def class_names(self):
+    return [path[:-len('.class')].replace(os.sep, '.') for path in self.class_files()]
+
+  def class_sizes(self):
+    """The size of the class file of each class, by class name."""
+    return {os.path.join(package, name)[:-len('.class')].replace(os.sep, '.'): size
+            for package, classes in self.packages.items()
+            for name, size in classes}
+
+  def size(self):
+    return sum(size for classes in self.packages.values() for name, size in classes)
+
+# The ClassIndex of each -d directory listed in this run. The directories
+# are build outputs, which the tools only read.
+class_indexes = {}
 
+def class_index(classdir):
+  key = os.path.abspath(classdir)
+  index = class_indexes.get(key)
+  if index is None:
+    index = class_indexes.setdefault(key, ClassIndex(classdir))
+  return index
+
+def get_class_files(javac_command):
+  classdir = class_directory(javac_command)
+  if not classdir:
+    return []
+  return [os.path.join(classdir, path) for path in class_index(classdir).class_files()]
+
+def get_classes(javac_command):
   classdir = class_directory(javac_command)
-  return [class_file_to_class_name(classdir, file)
-          for file in get_class_files(javac_command)]
+  if not classdir:
+    return []
+  return class_index(classdir).class_names()
 
 def source_path(javac_command):
   if 'javac_switches' in javac_command:
@@ -54,7 +313,30 @@ def source_path(javac_command):
       return os.pathsep.join(javac_command['java_files'])
   return None
 
-def run_cmd(cmd, args=None, tool=None):
+def run_cmd(cmd, args=None, tool=None, line_handler=None, env=None, heap=None, cpus=1):
+  """Run cmd, logging its output for tool.
+
+  If line_handler is given, the output is streamed: each line is passed to
+  line_handler (without its trailing newline) as soon as the command emits
+  it, and stats['output'] is left empty instead of buffering the whole
+  output in memory. env, if given, replaces the environment of cmd.
+
+  A command run for a tool only starts once heap bytes of memory (by
+  default, what jvm_heap finds in cmd) and cpus cores are free in the
+  run's budget (see budget); stats['queue_time'] is how long it waited."""
+  if args and tool:
+    if heap is None:
+      heap = jvm_heap(cmd)
+    with budget(args).reserve(heap, cpus, tool) as queue_time:
+      if queue_time >= 1:
+        log(args, tool, f"Waited {queue_time:.1f}s for {heap_size(heap)} of memory and {cpus} cores\n")
+      stats = run_admitted_cmd(cmd, args, tool, line_handler, env)
+      stats['queue_time'] = queue_time
+      return stats
+
+  return run_admitted_cmd(cmd, args, tool, line_handler, env)
+
+def run_admitted_cmd(cmd, args, tool, line_handler, env):
   stats = {'timed_out': False,
            'output': ''}
   # timer = None
@@ -66,7 +348,7 @@ def run_cmd(cmd, args=None, tool=None):
   if args and args.verbose and args.log_to_stderr:
     out = sys.stderr
   elif tool:
-    out_file = os.path.join(args.output_directory, f"{tool}-stdout.log")
+    out_file = log_file(args, tool)
     out = open(out_file, 'a')
 
   def output(line):
@@ -80,15 +362,19 @@ def run_cmd(cmd, args=None, tool=None):
     start_time = timeit.default_timer()
     timeout = args and args.timeout
 
-    process = subprocess.run(cmd, timeout=timeout,
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.STDOUT)
+    if line_handler:
+      stats['return_code'] = stream_cmd(cmd, timeout, output, line_handler, env)
+      stats['time'] = timeit.default_timer() - start_time
+    else:
+      process = subprocess.run(cmd, timeout=timeout, env=env,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
 
-    stats['output'] = process.stdout.decode('utf-8')
-    output(stats['output'])
+      stats['output'] = process.stdout.decode('utf-8')
+      output(stats['output'])
 
-    stats['time'] = timeit.default_timer() - start_time
-    stats['return_code'] = process.returncode
+      stats['time'] = timeit.default_timer() - start_time
+      stats['return_code'] = process.returncode
 
   except subprocess.TimeoutExpired as e:
     output(f"Timed out after {args.timeout} seconds on {friendly_cmd}\n")
@@ -101,3 +387,170 @@ def run_cmd(cmd, args=None, tool=None):
     out.close()
 
   return stats
+
+def stream_cmd(cmd, timeout, output, line_handler, env=None):
+  """Run cmd, passing each line of its output to output and line_handler
+  as it is emitted. Returns the exit code, or raises
+  subprocess.TimeoutExpired if cmd runs longer than timeout seconds."""
+  process = subprocess.Popen(cmd, env=env,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT)
+  timed_out = threading.Event()
+
+  def kill():
+    timed_out.set()
+    process.kill()
+
+  timer = threading.Timer(timeout, kill) if timeout else None
+  if timer:
+    timer.start()
+
+  try:
+    for raw_line in process.stdout:
+      line = raw_line.decode('utf-8', errors='replace')
+      output(line)
+      line_handler(line.rstrip('\n'))
+  except BaseException:
+    process.kill()
+    raise
+  finally:
+    if timer:
+      timer.cancel()
+    process.stdout.close()
+    return_code = process.wait()
+
+  if timed_out.is_set():
+    raise subprocess.TimeoutExpired(cmd, timeout)
+
+  return return_code
+
+def dependencies(javac_commands):
+  """For each javac command, the indices of the earlier javac commands whose
+  -d output directory is on its classpath. Only earlier commands count,
+  since the build already ran the commands in dependency order."""
+  outputs = {}
+  deps = []
+  for i, jc in enumerate(javac_commands):
+    cp = classpath(jc)
+    entries = [os.path.abspath(entry) for entry in cp.split(os.pathsep)
+               if entry] if cp else []
+    deps.append(sorted({outputs[entry] for entry in entries if entry in outputs}))
+
+    classdir = class_directory(jc)
+    if classdir:
+      outputs.setdefault(os.path.abspath(classdir), i)
+  return deps
+
+def critical_path_priorities(javac_commands, deps):
+  """For each javac command, the number of source files on the longest
+  chain of commands that starts with it and follows its dependents."""
+  dependents = [[] for jc in javac_commands]
+  for i, upstream in enumerate(deps):
+    for j in upstream:
+      dependents[j].append(i)
+
+  priorities = [0] * len(javac_commands)
+  # Dependencies always point backwards, so each command's dependents
+  # have been visited before it.
+  for i in reversed(range(len(javac_commands))):
+    cost = max(len(javac_commands[i].get('java_files', [])), 1)
+    priorities[i] = cost + max((priorities[j] for j in dependents[i]), default=0)
+  return priorities
+
+def run_jobs(args, javac_commands, job, tool=None, independent=False):
+  """Call job(i, javac_command) for each javac command, numbering them from
+  1, with up to args.jobs calls running at once. A command is started only
+  once the commands it depends on (see dependencies) have finished, and
+  commands on the longest remaining chain are started first. Returns the
+  results of the calls in the order of javac_commands.
+
+  If independent is true, job only reads the outputs of the build, so the
+  calls need not wait for each other; the commands with the most source
+  files are started first.
+
+  If --incremental was passed, calls for javac commands that have not
+  changed since tool last ran are skipped (see incremental.IncrementalRun)."""
+  jobs = getattr(args, 'jobs', 1) or 1
+  incremental_run = None
+  if tool and getattr(args, 'incremental', False):
+    incremental_run = incremental.IncrementalRun(args, tool, javac_commands, job, independent)
+    job = incremental_run.job
+  elif jobs <= 1:
+    return [job(i, jc) for i, jc in enumerate(javac_commands, 1)]
+
+  def run_job(i, jc):
+    current_job.index = i
+    try:
+      return job(i, jc)
+    finally:
+      current_job.index = None
+
+  deps = dependencies(javac_commands)
+  if independent:
+    deps = [[] for jc in javac_commands]
+  priorities = critical_path_priorities(javac_commands, deps)
+  waiting_on = [len(upstream) for upstream in deps]
+  dependents = [[] for jc in javac_commands]
+  for i, upstream in enumerate(deps):
+    for j in upstream:
+      dependents[j].append(i)
+
+  ready = [(-priorities[i], i) for i, count in enumerate(waiting_on) if count == 0]
+  heapq.heapify(ready)
+  running = {}
+  finished = [None] * len(javac_commands)
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+    while ready or running:
+      while ready and len(running) < jobs:
+        priority, i = heapq.heappop(ready)
+        running[pool.submit(run_job, i + 1, javac_commands[i])] = i
+
+      done, not_done = concurrent.futures.wait(
+        running, return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        i = running.pop(future)
+        finished[i] = future
+        for j in dependents[i]:
+          waiting_on[j] -= 1
+          if waiting_on[j] == 0:
+            heapq.heappush(ready, (-priorities[j], j))
+
+  merge_job_logs(args)
+  if incremental_run:
+    incremental_run.save()
+  return [future.result() for future in finished]
+
+def parallel_map(function, items, workers):
+  """Call function on each of items, with up to workers calls at once.
+  The calls log to the same files as the caller (see current_job).
+  Returns their results in the order of items."""
+  index = getattr(current_job, 'index', None)
+
+  def call(item):
+    current_job.index = index
+    try:
+      return function(item)
+    finally:
+      current_job.index = None
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+    return list(pool.map(call, items))
+
+def merge_job_logs(args):
+  """Append each per-job log to its tool's log, in job order, and remove it."""
+  pattern = re.compile(r'(.*)-stdout\.job(\d+)\.log$')
+  job_logs = {}
+  for path in glob.glob(os.path.join(args.output_directory, '*-stdout.job*.log')):
+    match = pattern.match(os.path.basename(path))
+    if match:
+      tool, index = match.groups()
+      job_logs.setdefault(tool, []).append((int(index), path))
+
+  for tool, logs in sorted(job_logs.items()):
+    with open(os.path.join(args.output_directory, f"{tool}-stdout.log"), 'a') as out:
+      for index, path in sorted(logs):
+        with open(path) as f:
+          for line in f:
+            out.write(line)
+        os.remove(path)
@@ -0,0 +1,146 @@
+import contextlib
+import os
+import shutil
+import socket
+import subprocess
+import time
+
+from . import common
+
+NAILGUN_JAR = 'nailgun-server.jar'
+NAILGUN_MAIN = 'com.facebook.nailgun.NGServer'
+NAILGUN_CLIENTS = ('ng', 'ng-nailgun')
+JAVAC_MAIN = 'com.sun.tools.javac.Main'
+
+# How long to wait for the server to start accepting connections.
+STARTUP_TIMEOUT = 60
+
+# The largest share of the run's memory budget the server may reserve, so
+# that the JVMs that run outside it (e.g. WPI's delombok) can still start.
+MAX_BUDGET_SHARE = 0.5
+
+class CompileServer(object):
+  """A Nailgun server that keeps javac and the Checker Framework loaded
+  between compilations. Commands for the Checker Framework's javac are
+  rewritten by command() to run in the server via the ng client, which
+  saves a JVM startup and the loading of the checker for each of them.
+
+  The server runs in the current directory, so relative paths in the
+  commands (and the build/whole-program-inference directory that WPI
+  writes to) resolve the same way as they would for a fresh javac.
+
+  The server's heap is reserved in the run's budget (see common.budget)
+  for as long as it runs; the ng clients, which do no work themselves,
+  are charged no memory (see client_heap). The server reserves no more
+  than MAX_BUDGET_SHARE of the budget, and without a -J-Xmx its heap is
+  limited to what it reserves."""
+
+  def __init__(self, args, jvm_args):
+    self.args = args
+    self.jvm_args = jvm_args
+    self.port = None
+    self.process = None
+    self.client = None
+    self.reservation = contextlib.ExitStack()
+
+  def start(self):
+    if self.args.jdkVersion is None or int(self.args.jdkVersion) == 8:
+      raise ValueError("--compile-server requires --jdkVersion 11 or later")
+
+    self.client = next(filter(None, map(shutil.which, NAILGUN_CLIENTS)), None)
+    if not self.client:
+      raise ValueError("--compile-server requires the Nailgun client (ng) on the PATH")
+
+    if not self.args.lib_dir:
+      raise ValueError(f"--compile-server requires {NAILGUN_JAR} in the --lib directory")
+
+    server_classpath = ':'.join([
+      os.path.join(os.environ['CHECKERFRAMEWORK'], 'checker', 'dist', 'checker.jar'),
+      os.path.join(self.args.lib_dir, NAILGUN_JAR)])
+
+    with socket.socket() as s:
+      s.bind(('127.0.0.1', 0))
+      self.port = s.getsockname()[1]
+
+    # Nailgun traps System.exit, which javac calls when it finishes, with a
+    # security manager; newer JDKs only allow one if asked to.
+    security_args = []
+    if int(self.args.jdkVersion) >= 16:
+      security_args = ['-Djava.security.manager=allow']
+
+    cmd = (['java'] + security_args + self.jvm_args +
+           ['-classpath', server_classpath, NAILGUN_MAIN, f"127.0.0.1:{self.port}"])
+    budget = common.budget(self.args)
+    heap = common.jvm_heap(cmd)
+    limit = int(min(heap, budget.memory * MAX_BUDGET_SHARE))
+    if heap > limit:
+      if common.explicit_heap(cmd) is None:
+        cmd = common.with_heap(cmd, limit)
+      else:
+        common.log(self.args, 'compile-server',
+                   f"The server's -Xmx is more than {MAX_BUDGET_SHARE:.0%} of --memory-limit; "
+                   f"only {common.heap_size(limit)} of it is reserved\n")
+      heap = limit
+    queue_time = self.reservation.enter_context(budget.reserve(heap, 0, 'compile-server'))
+    if queue_time >= 1:
+      common.log(self.args, 'compile-server', f"Waited {queue_time:.1f}s for {common.heap_size(heap)} of memory\n")
+    common.log(self.args, 'compile-server', f"Starting {' '.join(cmd)}\n")
+    with open(common.log_file(self.args, 'compile-server'), 'a') as out:
+      self.process = subprocess.Popen(cmd, stdout=out, stderr=subprocess.STDOUT)
+
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+      if self.process.poll() is not None:
+        self.stop()
+        raise ValueError("the compile server exited during startup; see compile-server-stdout.log")
+      try:
+        with socket.create_connection(('127.0.0.1', self.port), timeout=1):
+          return self
+      except OSError:
+        time.sleep(0.2)
+
+    self.stop()
+    raise ValueError(f"the compile server did not start within {STARTUP_TIMEOUT} seconds")
+
+  def command(self, cmd):
+    """Rewrite cmd, an invocation of the Checker Framework's javac, to run
+    in the server. -J options are dropped: they configure the JVM, which is
+    the server's."""
+    javac_args = [arg for arg in cmd[1:] if not arg.startswith('-J')]
+    return [self.client, '--nailgun-port', str(self.port), JAVAC_MAIN] + javac_args
+
+  def stop(self):
+    if not self.process:
+      self.reservation.close()
+      return
+    subprocess.run([self.client, '--nailgun-port', str(self.port), 'ng-stop'],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+      self.process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+      self.process.kill()
+      self.process.wait()
+    self.process = None
+    self.reservation.close()
+
+def start(args, checker_command):
+  """Start a compile server for checker_command if --compile-server was
+  passed, passing it the -J options in checker_command. Returns None
+  otherwise."""
+  if not args.compile_server:
+    return None
+  jvm_args = [arg[2:] for arg in checker_command if arg.startswith('-J')]
+  return CompileServer(args, jvm_args).start()
+
+def command(server, cmd):
+  return server.command(cmd) if server else cmd
+
+def client_heap(server, javac_command, cmd):
+  """The heap to charge for running the Checker Framework command cmd via
+  command(server, cmd): nothing if it runs in server, whose heap is
+  reserved for as long as the server runs."""
+  return 0 if server else common.checker_heap(javac_command, cmd)
+
+def stop(server):
+  if server:
+    server.stop()
@@ -1,6 +1,9 @@
 import argparse
+import glob
+import heapq
 import json
 import os
+import re
 
 from . import common, jsoninv
 
@@ -11,22 +14,60 @@ dyntrace_group.add_argument('-X', '--daikon-xml',
                         action='store_true',
                         help='Have Daikon emit XML')
 
+dyntrace_group.add_argument('--json-lines',
+                        action='store_true',
+                        dest='json_lines',
+                        help='With --daikon-xml, write the invariants as invariants.jsonl, '
+                             'one method per line, rather than as invariants.json')
+
 # choose error revealing driver
 dyntrace_group.add_argument('--error-driver',
                         action='store_true',
                         dest='error_driver',
                         help='Chose Error Revealing Driver')
 
-no_jdk = False
-no_ternary = False
+GiB = 2**30
+MiB = 2**20
+
+# The heap of each stage's JVM: a base, plus an amount for each class of
+# the module, up to a maximum. DynComp, Chicory and Daikon need as much
+# memory as the tests run for, whatever the number of classes, so their
+# base is the fixed heap every module used to get.
+STAGE_HEAPS = {
+  'randoop': (1 * GiB, 1 * MiB, 4 * GiB),
+  'dyncomp': (3 * GiB, 2 * MiB, 8 * GiB),
+  'chicory': (3 * GiB, 2 * MiB, 8 * GiB),
+  'daikon': (4 * GiB, 3 * MiB, 12 * GiB),
+}
+
+def stage_heaps(class_count):
+  return {stage: common.heap_size(common.scaled_heap(class_count, *heap))
+          for stage, heap in STAGE_HEAPS.items()}
+
+dyntrace_group.add_argument('--randoop-shards', metavar='<n>',
+                        type=int, default=1, dest='randoop_shards',
+                        help='Split the classes of each javac command into <n> partitions, '
+                             'and generate tests for each with its own Randoop process, all at once')
+
+dyntrace_group.add_argument('--randoop-shard-by',
+                        choices=['package', 'size'], default='package',
+                        dest='randoop_shard_by',
+                        help='Partition the classes for --randoop-shards by package (the default), '
+                             'or by class file size')
+
+dyntrace_group.add_argument('--daikon-shards', metavar='<n>',
+                        type=int, default=1, dest='daikon_shards',
+                        help='Split the packages traced for each javac command into <n> partitions, '
+                             'trace each with its own Chicory process and run Daikon on each trace '
+                             'at once, then merge the invariants')
 
 def run(args, javac_commands, jars):
-  i = 1
   out_dir = os.path.basename(args.output_directory)
 
-  for jc in javac_commands:
+  def run_dyntrace(i, jc):
     dyntrace(args, i, jc, out_dir, args.lib_dir)
-    i = i + 1
+
+  common.run_jobs(args, javac_commands, run_dyntrace, 'dyntrace', independent=True)
 
 def dyntrace(args, i, java_command, out_dir, lib_dir, run_parts=['randoop','chicory']):
   def lib(jar):
@@ -64,12 +105,21 @@ def dyntrace(args, i, java_command, out_dir, lib_dir, run_parts=['randoop','chic
                                 compile_classpath])
   replace_call_classpath = lib('replacecall.jar')
 
+  classes = sorted(common.get_classes(java_command))
+  heaps = stage_heaps(len(classes))
+
   if 'randoop' in run_parts:
-    classes = sorted(common.get_classes(java_command))
-    class_list_file = make_class_list(test_class_directory, classes)
     junit_after_path = get_special_file("junit-after", out_dir, i)
 
-    generate_tests(args, randoop_classpath, class_list_file, test_src_dir, junit_after_path, replace_call_classpath)
+    shards = getattr(args, 'randoop_shards', 1) or 1
+    if shards > 1:
+      partitions = partition_classes(classes, shards, args.randoop_shard_by,
+                                     common.class_index(classdir).class_sizes())
+      generate_sharded_tests(args, randoop_classpath, partitions, test_class_directory, test_src_dir,
+                             junit_after_path, replace_call_classpath, i)
+    else:
+      class_list_file = make_class_list(test_class_directory, classes)
+      generate_tests(args, randoop_classpath, class_list_file, test_src_dir, junit_after_path, replace_call_classpath, log_suffix=i, heap=heaps['randoop'])
     files_to_compile = get_files_to_compile(test_src_dir)
     if not files_to_compile:
       return
@@ -78,31 +128,53 @@ def dyntrace(args, i, java_command, out_dir, lib_dir, run_parts=['randoop','chic
   if 'chicory' in run_parts:
     selects = get_select_list(classdir)
     omit_file_path = get_special_file("omit-list", out_dir, i)
-    omits = get_omit_list(omit_file_path)
-
-    run_dyncomp(args, chicory_classpath, randoop_driver, test_class_directory, selects, omits)
-    run_chicory(args, chicory_classpath, randoop_driver, test_class_directory, selects, omits)
-    run_daikon(args, chicory_classpath, test_class_directory, False)
-    if 'invcounts' in run_parts:
-      run_daikon(args, chicory_classpath, test_class_directory, True)
+    omits, no_jdk, no_ternary = get_omit_list(omit_file_path)
+
+    run_dyncomp(args, chicory_classpath, randoop_driver, test_class_directory, selects, omits, no_jdk, heaps['dyncomp'])
+
+    shards = getattr(args, 'daikon_shards', 1) or 1
+    packages = package_selects(classdir) if shards > 1 else []
+    if len(packages) > 1:
+      run_sharded_daikon(args, chicory_classpath, randoop_driver, test_class_directory,
+                         packages, omits, shards, no_ternary, heaps['daikon'],
+                         invcounts='invcounts' in run_parts)
+    else:
+      if shards > 1:
+        common.log(args, 'dyntrace', f"--daikon-shards: {classdir} has only one package to trace, "
+                                     "so Chicory and Daikon run in a single process\n")
+      run_chicory(args, chicory_classpath, randoop_driver, test_class_directory, selects, omits, heaps['chicory'])
+      run_daikon(args, chicory_classpath, test_class_directory, False, no_ternary, heaps['daikon'])
+      if 'invcounts' in run_parts:
+        run_daikon(args, chicory_classpath, test_class_directory, True, no_ternary, heaps['daikon'])
 
     if args.daikon_xml:
-      daikon_print_xml(args, chicory_classpath, test_class_directory)
+      daikon_print_xml(args, chicory_classpath, test_class_directory, heaps['daikon'])
+
+SELECT_PREFIX = "--ppt-select-pattern="
 
 def get_select_list(classdir):
   """Get a list of all directories under classdir containing class files."""
   selects = []
   last_add = " " # guaranteed not to match
-  for root, dirs, files in os.walk(classdir):
-    if not root.startswith(last_add):
-      for file in files:
-        if file.endswith('.class'):
-          if root == classdir:
-            break
-          last_add = root
-          select = "--ppt-select-pattern=" + root.replace(classdir + "/", '').replace('/','.')
-          selects.append(select)
-          break
+  for package in common.class_index(classdir).packages:
+    root = os.path.join(classdir, package)
+    if package and not root.startswith(last_add):
+      last_add = root
+      select = SELECT_PREFIX + package.replace('/', '.')
+      selects.append(select)
+  return selects
+
+def package_selects(classdir):
+  """A --ppt-select-pattern for each (named) package under classdir that
+  has class files, with the number of classes in it. Unlike the patterns
+  from get_select_list, each one selects only the classes of its own
+  package, not those of its subpackages: Chicory matches the patterns
+  against class names, and a class name has no dots after its package."""
+  selects = []
+  for package, classes in common.class_index(classdir).packages.items():
+    if package:
+      pattern = '^' + re.escape(package.replace(os.sep, '.') + '.') + '[^.]+$'
+      selects.append((SELECT_PREFIX + pattern, len(classes)))
   return selects
 
 def get_special_file(special_type, out_dir, i):
@@ -117,7 +189,8 @@ def get_special_file(special_type, out_dir, i):
   return None
 
 def get_omit_list(omit_file_path):
-  global no_jdk, no_ternary
+  """Returns the --ppt-omit-pattern options listed in omit_file_path, and
+  whether it asked for NO-JDK and NO-TERNARY."""
   no_jdk = False
   no_ternary = False
   omits = []
@@ -132,10 +205,10 @@ def get_omit_list(omit_file_path):
         else:
             omit = "--ppt-omit-pattern=" + line.strip()
             omits.append(omit)
-  return omits
+  return omits, no_jdk, no_ternary
 
-def make_class_list(out_dir, classes):
-  with open(os.path.join(out_dir,"classlist.txt"), 'w') as class_file:
+def make_class_list(out_dir, classes, name="classlist.txt"):
+  with open(os.path.join(out_dir, name), 'w') as class_file:
     for c in classes:
       if "package-info" not in c:
         class_file.write(c)
@@ -143,14 +216,106 @@ def make_class_list(out_dir, classes):
     class_file.flush()
     return class_file.name
 
-def generate_tests(args, classpath, class_list_file, test_src_dir, junit_after_path, rc_classpath, time_limit=200, output_limit=4000):
+def partition_classes(classes, shards, by, class_sizes):
+  """Split classes into at most shards partitions of about the same size.
+  By package, whole packages are spread over the partitions, largest
+  first, so that each partition's classes can call each other's
+  package-private methods; by size, the classes themselves are, weighed
+  by the size of their class files."""
+  if by == 'package':
+    packages = {}
+    for c in classes:
+      packages.setdefault(c.rpartition('.')[0], []).append(c)
+    groups = [(len(members), members) for members in packages.values()]
+  else:
+    groups = [(class_sizes.get(c, 1), [c]) for c in classes]
+
+  return balance(groups, shards)
+
+def balance(groups, shards):
+  """Spread groups, (weight, members) pairs, over at most shards partitions
+  of about the same total weight: each group, heaviest first, goes to the
+  partition that weighs least so far."""
+  partitions = [[] for shard in range(shards)]
+  loads = [(0, shard) for shard in range(shards)]
+  heapq.heapify(loads)
+  for weight, members in sorted(groups, key=lambda group: group[0], reverse=True):
+    load, shard = heapq.heappop(loads)
+    partitions[shard].extend(members)
+    heapq.heappush(loads, (load + weight, shard))
+
+  return [sorted(partition) for partition in partitions if partition]
+
+def generate_sharded_tests(args, classpath, partitions, test_class_directory, test_src_dir, junit_after_path, rc_classpath, i):
+  """Generate tests for each partition of the classes with its own Randoop
+  process, all at once, each with its own class list, output directory
+  and random seed. The test classes of partition k are named
+  RegressionTestS<k>... and ErrorTestS<k>..., and their drivers
+  RegressionTestS<k>Driver and ErrorTestS<k>Driver; a RegressionTestDriver
+  and ErrorTestDriver in test_src_dir run the drivers of every partition."""
+  def generate(shard):
+    k, partition = shard
+    class_list_file = make_class_list(test_class_directory, partition, f"classlist.{k}.txt")
+    generate_tests(args, classpath, class_list_file, os.path.join(test_src_dir, f"shard{k}"),
+                   junit_after_path, rc_classpath, log_suffix=f"{i}.{k}",
+                   heap=stage_heaps(len(partition))['randoop'],
+                   randomseed=k, basename_suffix=f"S{k}")
+
+  common.parallel_map(generate, list(enumerate(partitions)), len(partitions))
+
+  for kind in ("RegressionTest", "ErrorTest"):
+    drivers = []
+    for k in range(len(partitions)):
+      shard_driver = os.path.join(test_src_dir, f"shard{k}", f"{kind}S{k}Driver.java")
+      if os.path.isfile(shard_driver):
+        detach_driver(shard_driver)
+        drivers.append(f"{kind}S{k}Driver")
+    if drivers:
+      write_merged_driver(os.path.join(test_src_dir, f"{kind}Driver.java"), f"{kind}Driver", drivers)
+
+EXIT_CALL = re.compile(r'System\.exit\(([^;]*)\);')
+
+def detach_driver(path):
+  """Make the Randoop driver at path throw an exception where it would
+  exit the JVM, which it does once it has run all its tests if any of them
+  failed, as error-revealing tests do by design."""
+  with open(path) as f:
+    source = f.read()
+  source = EXIT_CALL.sub(r'throw new RuntimeException("failing tests, exit status " + (\1));', source)
+  with open(path, 'w') as f:
+    f.write(source)
+
+def write_merged_driver(path, driver, shard_drivers):
+  """Write a test driver that calls the main method of each of
+  shard_drivers, which detach_driver has made throw rather than exit, so
+  that every shard's tests run. It then exits with 1 if any shard's tests
+  failed, as Randoop's drivers do."""
+  with open(path, 'w') as f:
+    f.write(f"public class {driver} {{\n")
+    f.write("  public static void main(String[] args) {\n")
+    f.write("    int failedShards = 0;\n")
+    for shard_driver in shard_drivers:
+      f.write("    try {\n")
+      f.write(f"      {shard_driver}.main(args);\n")
+      f.write("    } catch (RuntimeException e) {\n")
+      f.write(f"      System.err.println(\"{shard_driver}: \" + e.getMessage());\n")
+      f.write("      failedShards++;\n")
+      f.write("    }\n")
+    f.write("    if (failedShards != 0) {\n")
+    f.write("      System.exit(1);\n")
+    f.write("    }\n")
+    f.write("  }\n")
+    f.write("}\n")
+
+def generate_tests(args, classpath, class_list_file, test_src_dir, junit_after_path, rc_classpath, time_limit=200, output_limit=4000, log_suffix='', heap=None, randomseed=None, basename_suffix=''):
 
   # Methods to be omitted due to non-determinism.
   omitted_methods = "\"(org\\.la4j\\.operation\\.ooplace\\.OoPlaceKroneckerProduct\\.applyCommon)|(PseudoOracle\\.verifyFace)|(org\\.znerd\\.math\\.NumberCentral\\.createRandomInteger)|(org\\.jbox2d\\.common\\.MathUtils\\.randomFloat.*)|(org\\.jbox2d\\.utests\\.MathTest\\.testFastMath)|(org\\.jbox2d\\.testbed\\.tests\\.DynamicTreeTest.*)|(org\\.la4j\\.Matrix.*)\""
 
-  selection_log_file = "dljc-out/selection-log.txt"
-  operation_log_file = "dljc-out/operation-history-log.txt"
-  randoop_log_file = "dljc-out/randoop-log.txt"
+  # Each javac command gets its own logs, since they may be generated at once.
+  selection_log_file = f"dljc-out/selection-log{log_suffix}.txt"
+  operation_log_file = f"dljc-out/operation-history-log{log_suffix}.txt"
+  randoop_log_file = f"dljc-out/randoop-log{log_suffix}.txt"
 
   randoop_command = ["java", "-ea",
                      "-classpath", classpath,
@@ -171,6 +336,16 @@ def generate_tests(args, classpath, class_list_file, test_src_dir, junit_after_p
                      f"--selection-log={selection_log_file}",
                      f"--operation-history-log={operation_log_file}"]
 
+  if heap:
+    randoop_command.insert(1, f"-Xmx{heap}")
+
+  if randomseed is not None:
+    randoop_command.append(f"--randomseed={randomseed}")
+
+  if basename_suffix:
+    randoop_command.append(f"--regression-test-basename=RegressionTest{basename_suffix}")
+    randoop_command.append(f"--error-test-basename=ErrorTest{basename_suffix}")
+
   if junit_after_path:
     randoop_command.append(f"--junit-after-all={junit_after_path}")
 
@@ -198,8 +373,82 @@ def compile_test_cases(args, classpath, test_class_directory, files_to_compile):
 
   common.run_cmd(compile_command, args, 'randoop')
 
-def run_chicory(args, classpath, main_class, out_dir, selects=[], omits=[]):
-  chicory_command = ["java", "-Xmx3G",
+def run_sharded_daikon(args, classpath, main_class, out_dir, packages, omits, shards, no_ternary, merge_heap, invcounts=False):
+  """Trace each partition of packages, (select, class count) pairs from
+  package_selects, with its own Chicory process, and run Daikon on each
+  partition's trace, all at once; then merge the invariants of every
+  partition into invariants.gz with MergeInvariants. A partition whose
+  Chicory or Daikon fails is left out of the merge. What each partition's
+  commands did, and how long they took, is written to daikon-shards.json
+  in out_dir."""
+  counts = dict(packages)
+  partitions = balance([(count, [select]) for select, count in packages], shards)
+
+  # Files from an earlier run, possibly with more partitions, must not be
+  # mistaken for this run's.
+  stale = glob.glob(os.path.join(out_dir, f"{main_class}.shard*.dtrace.gz"))
+  stale.extend(glob.glob(os.path.join(out_dir, "invariants.shard*.gz")))
+  stale.append(os.path.join(out_dir, "invariants.gz"))
+  for path in stale:
+    if os.path.exists(path):
+      os.remove(path)
+
+  def trace(shard):
+    k, partition = shard
+    heaps = stage_heaps(sum(counts[select] for select in partition))
+    dtrace_file = f"{main_class}.shard{k}.dtrace.gz"
+    invariants_file = os.path.join(out_dir, f"invariants.shard{k}.gz")
+    report = {'shard': k,
+              'patterns': [select[len(SELECT_PREFIX):] for select in partition],
+              'classes': sum(counts[select] for select in partition),
+              'chicory': None,
+              'daikon': None}
+
+    stats = run_chicory(args, classpath, main_class, out_dir, partition, omits, heaps['chicory'],
+                        dtrace_file=dtrace_file)
+    report['chicory'] = timing(stats)
+    if succeeded(stats, os.path.join(out_dir, dtrace_file)):
+      stats = run_daikon(args, classpath, out_dir, invcounts, no_ternary, heaps['daikon'],
+                         dtrace_file=os.path.join(out_dir, dtrace_file), output=invariants_file)
+      report['daikon'] = timing(stats)
+    report['succeeded'] = report['daikon'] is not None and succeeded(stats, invariants_file)
+    if not report['succeeded']:
+      common.log(args, 'daikon', f"Shard {k} failed; leaving it out of invariants.gz\n")
+    return invariants_file, report
+
+  results = common.parallel_map(trace, list(enumerate(partitions)), len(partitions))
+
+  invariants_files = [invariants_file for invariants_file, report in results if report['succeeded']]
+  merge = None
+  if invariants_files:
+    merge = timing(merge_invariants(args, classpath, out_dir, invariants_files, merge_heap))
+
+  with open(os.path.join(out_dir, 'daikon-shards.json'), 'w') as f:
+    json.dump({'shards': [report for invariants_file, report in results],
+               'merge': merge}, f, indent=4)
+
+def timing(stats):
+  return {key: stats.get(key) for key in ('time', 'queue_time', 'return_code', 'timed_out')}
+
+def succeeded(stats, output):
+  """Whether the command that stats are for finished, exited with 0 and
+  wrote output."""
+  return (not stats.get('timed_out') and stats.get('return_code') == 0
+          and os.path.exists(output))
+
+def merge_invariants(args, classpath, out_dir, invariants_files, heap='4G'):
+  merge_command = ["java", f"-Xmx{heap}",
+                   "-classpath", classpath,
+                   "daikon.MergeInvariants",
+                   "-o", os.path.join(out_dir, "invariants.gz")]
+  merge_command.extend(invariants_files)
+
+  print("Running command", " ".join(merge_command))
+
+  return common.run_cmd(merge_command, args, 'daikon')
+
+def run_chicory(args, classpath, main_class, out_dir, selects=[], omits=[], heap='3G', dtrace_file=None):
+  chicory_command = ["java", f"-Xmx{heap}",
                      "-classpath", classpath,
                      "daikon.Chicory",
                      f"--output_dir={out_dir}"]
@@ -213,17 +462,20 @@ def run_chicory(args, classpath, main_class, out_dir, selects=[], omits=[]):
   dc_out_path = os.path.join(out_dir, decls_dyn_comp_file)
   chicory_command.append("--comparability-file={}".format(dc_out_path))
 
+  if dtrace_file:
+    chicory_command.append(f"--dtrace-file={dtrace_file}")
+
   chicory_command.extend(selects)
   chicory_command.extend(omits)
   chicory_command.append(main_class)
 
   print("Running command", " ".join(chicory_command))
 
-  common.run_cmd(chicory_command, args, 'chicory')
+  return common.run_cmd(chicory_command, args, 'chicory')
 
 
-def run_dyncomp(args, classpath, main_class, out_dir, selects=[], omits=[]):
-  dyncomp_command = ["java", "-Xmx3G",
+def run_dyncomp(args, classpath, main_class, out_dir, selects=[], omits=[], no_jdk=False, heap='3G'):
+  dyncomp_command = ["java", f"-Xmx{heap}",
                      "-classpath", classpath,
                      "daikon.DynComp",
                      "--approximate-omitted-ppts",
@@ -239,11 +491,11 @@ def run_dyncomp(args, classpath, main_class, out_dir, selects=[], omits=[]):
 
   common.run_cmd(dyncomp_command, args, 'dyncomp')
 
-def run_daikon(args, classpath, out_dir, invcounts):
-  daikon_command = ["java", "-Xmx4G",
+def run_daikon(args, classpath, out_dir, invcounts, no_ternary=False, heap='4G', dtrace_file=None, output=None):
+  daikon_command = ["java", f"-Xmx{heap}",
                      "-classpath", classpath,
                      "daikon.Daikon",
-                     "-o", os.path.join(out_dir, "invariants.gz")]
+                     "-o", output or os.path.join(out_dir, "invariants.gz")]
   if invcounts:
     daikon_command.append("--config_option")
     daikon_command.append("daikon.Daikon.calc_possible_invs=true")
@@ -252,14 +504,14 @@ def run_daikon(args, classpath, out_dir, invcounts):
     daikon_command.append("daikon.inv.ternary.threeScalar.LinearTernary.enabled=false")
     daikon_command.append("--config_option")
     daikon_command.append("daikon.inv.ternary.threeScalar.LinearTernaryFloat.enabled=false")
-  daikon_command.append(os.path.join(out_dir, "RegressionTestDriver.dtrace.gz"))
+  daikon_command.append(dtrace_file or os.path.join(out_dir, "RegressionTestDriver.dtrace.gz"))
 
   print("Running command", " ".join(daikon_command))
 
-  common.run_cmd(daikon_command, args, 'daikon')
+  return common.run_cmd(daikon_command, args, 'daikon')
 
-def daikon_print_xml(args, classpath, out_dir):
-  daikon_command = ["java", "-Xmx4G",
+def daikon_print_xml(args, classpath, out_dir, heap='4G'):
+  daikon_command = ["java", f"-Xmx{heap}",
                     "-classpath", classpath,
                     "daikon.PrintInvariants",
                     "--wrap_xml",
@@ -267,6 +519,4 @@ def daikon_print_xml(args, classpath, out_dir):
                     os.path.join(out_dir, "invariants.gz")]
 
   common.run_cmd(daikon_command, args, 'daikon')
-  js = jsoninv.generate_json_invariants(args, out_dir)
-  with open(os.path.join(out_dir, 'invariants.json'), 'w') as f:
-    json.dump(js, f)
+  jsoninv.write_json_invariants(args, out_dir, getattr(args, 'json_lines', False))
@@ -1,13 +1,13 @@
 import os
 
-from . import dyntrace
+from . import common, dyntrace
 
 argparser = None
 
 def run(args, javac_commands, jars):
-  i = 1
   out_dir = os.path.basename(args.output_directory)
 
-  for jc in javac_commands:
+  def run_dyntrace(i, jc):
     dyntrace.dyntrace(args, i, jc, out_dir, args.lib_dir, ['randoop', 'chicory', 'invcounts'])
-    i = i + 1
+
+  common.run_jobs(args, javac_commands, run_dyntrace, 'dyntracecounts', independent=True)
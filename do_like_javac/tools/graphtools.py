@@ -47,9 +47,9 @@ def run(args, javac_commands, jars):
     common.run_cmd(cmd, args, 'graphtools')
   else:
     # prog2dfg.jar and apilearner.jar require projects to be built first
-    for jc in javac_commands:
+    def graphtool(i, jc):
       java_files = jc['java_files']
-      java_files_file = os.path.join(os.getcwd(), '__java_file_names.txt')
+      java_files_file = os.path.join(os.getcwd(), f'__java_file_names{i}.txt')
 
       class_dir = common.class_directory(jc)
 
@@ -69,3 +69,5 @@ def run(args, javac_commands, jars):
       print(f"Running command", " ".join(cmd))
 
       common.run_cmd(cmd, args, 'graphtools')
+
+    common.run_jobs(args, javac_commands, graphtool, 'graphtools')
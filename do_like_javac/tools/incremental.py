@@ -0,0 +1,127 @@
+import glob
+import hashlib
+import json
+import os
+import threading
+
+from . import common
+
+# The format of the state files (see common.load_json).
+STATE_VERSION = 1
+STATE_DIR = 'dljc-incremental'
+
+# dljc arguments that do not change what a tool reports.
+IGNORED_ARGS = ('output_directory', 'log_to_stderr', 'verbose', 'timeout',
+                'jobs', 'memory_limit', 'cpu_limit', 'cache', 'cache_size',
+                'incremental', 'tool', 'nullarg')
+
+class IncrementalRun(object):
+  """Skips the jobs of run_jobs whose javac command, source files, classpath
+  jars and tool arguments are unchanged since the last run of the tool, and
+  whose upstream commands (see common.dependencies) were skipped too. The
+  logs the job wrote last time are replayed instead.
+
+  Independent jobs don't wait for their upstream commands, so whether
+  those were skipped isn't known yet; instead, the class files in the
+  directories on their classpath are part of their fingerprint."""
+
+  def __init__(self, args, tool, javac_commands, job, independent=False):
+    self.args = args
+    self.tool = tool
+    self.javac_commands = javac_commands
+    self.run_job = job
+    self.state_file = os.path.join(args.output_directory, STATE_DIR, f"{tool}.json")
+    self.previous_state = load_state(self.state_file)
+    self.state = {}
+    self.independent = independent
+    self.deps = common.dependencies(javac_commands)
+    if independent:
+      self.deps = [[] for jc in javac_commands]
+    self.reran = [False] * len(javac_commands)
+    self.flags = tool_flags(args)
+    self.lock = threading.Lock()
+
+  def job(self, i, jc):
+    key = command_key(jc)
+    fingerprint = command_fingerprint(jc, self.flags, self.independent)
+    previous = self.previous_state.get(key)
+    upstream_reran = any(self.reran[j] for j in self.deps[i - 1])
+
+    if previous and previous['fingerprint'] == fingerprint and not upstream_reran:
+      for tool, message in sorted(previous['logs'].items()):
+        common.log(self.args, tool, message)
+      with self.lock:
+        self.state[key] = previous
+      return None
+
+    self.reran[i - 1] = True
+    result = self.run_job(i, jc)
+    with self.lock:
+      self.state[key] = {'fingerprint': fingerprint,
+                         'logs': job_logs(self.args, i)}
+    return result
+
+  def save(self):
+    skipped = self.reran.count(False)
+    common.log(self.args, self.tool,
+               f"Incremental: re-ran {len(self.javac_commands) - skipped} "
+               f"javac commands, replayed {skipped}\n")
+
+    common.write_json(self.state_file,
+                      {'version': STATE_VERSION, 'commands': self.state})
+
+def load_state(state_file):
+  state = common.load_json(state_file, STATE_VERSION)
+  if state is None or not isinstance(state.get('commands'), dict):
+    return {}
+  return state['commands']
+
+def tool_flags(args):
+  return {k: v for k, v in vars(args).items() if k not in IGNORED_ARGS}
+
+def command_key(jc):
+  """Identifies a javac command across runs by its output directory and
+  source files."""
+  identity = [common.class_directory(jc), sorted(jc.get('java_files', []))]
+  return hashlib.sha256(json.dumps(identity).encode('utf-8')).hexdigest()
+
+def command_fingerprint(jc, flags, classpath_dirs=False):
+  """A hash of everything a tool's result for jc depends on, other than its
+  upstream commands: the javac switches, the contents of the source files,
+  the size and modification time of the jars on the classpath, and the
+  tool arguments. With classpath_dirs, it also covers the class files in
+  the classpath's directories: how many there are, their total size and
+  the latest modification time."""
+  digest = hashlib.sha256()
+  digest.update(json.dumps([jc.get('javac_switches', {}), flags],
+                           sort_keys=True, default=str).encode('utf-8'))
+
+  for java_file in jc.get('java_files', []):
+    digest.update(java_file.encode('utf-8'))
+    try:
+      with open(java_file, 'rb') as f:
+        digest.update(hashlib.sha256(f.read()).digest())
+    except OSError:
+      digest.update(b'missing')
+
+  cp = common.classpath(jc)
+  for entry in (cp.split(os.pathsep) if cp else []):
+    # Directories on the classpath are the outputs of upstream commands,
+    # which are tracked separately.
+    if os.path.isfile(entry):
+      stat = os.stat(entry)
+      digest.update(f"{entry}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode('utf-8'))
+    elif classpath_dirs and os.path.isdir(entry):
+      index = common.class_index(entry)
+      digest.update(f"{entry}\0{len(index.class_files())}\0{index.size()}\0{index.mtime}\0".encode('utf-8'))
+
+  return digest.hexdigest()
+
+def job_logs(args, i):
+  """The per-job logs written by job i, keyed by tool."""
+  logs = {}
+  suffix = f"-stdout.job{i}.log"
+  for path in glob.glob(os.path.join(args.output_directory, f"*{suffix}")):
+    with open(path) as f:
+      logs[os.path.basename(path)[:-len(suffix)]] = f.read()
+  return logs
@@ -28,7 +28,7 @@ def run(args, javac_commands, jars):
 
     print(os.environ)
 
-    for jc in javac_commands:
+    def infer(i, jc):
         target_cp = jc['javac_switches']['classpath'] + \
             ':' + os.path.join(args.lib_dir, 'ontology.jar')
 
@@ -53,7 +53,10 @@ def run(args, javac_commands, jars):
                              '--logLevel=WARNING',
                              '-afud', args.afuOutputDir]
         cmd.extend(jc['java_files'])
-        
+        cmd = common.with_checker_heap(jc, cmd)
+
         print(f"Running command", " ".join(cmd))
 
-        common.run_cmd(cmd, args, 'infer')
+        common.run_cmd(cmd, args, 'infer', heap=common.checker_heap(jc, cmd))
+
+    common.run_jobs(args, javac_commands, infer, 'infer')
@@ -1,41 +1,102 @@
+import json
 import os
 import re
 import xml.etree.ElementTree as ET
 
 from . import common
 
+SIGNATURE_PATTERN = re.compile(r'(.*)\.([^\(.]+)\.?\((.*)\)')
+INVARIANT_PATTERN = re.compile(r'(.*) ([=!<>]+|one of) (.*)')
 
-def generate_json_invariants(args, out_dir):
+
+def write_json_invariants(args, out_dir, json_lines=False):
+  """Convert out_dir's invariants.xml to invariants.json or, with
+  json_lines, to invariants.jsonl with one method per line. Returns the
+  file written, or None if there was nothing to convert.
+
+  The XML is parsed incrementally, and each method is written out as soon
+  as the program points after it belong to another method, so only one
+  method is ever held in memory. PrintInvariants writes program points
+  sorted by name, so the ENTER and EXIT points of a method come one after
+  the other."""
   filename = os.path.join(out_dir, 'invariants.xml')
   if not os.path.exists(filename):
-    return
+    return None
+
+  if json_lines:
+    output = os.path.join(out_dir, 'invariants.jsonl')
+  else:
+    output = os.path.join(out_dir, 'invariants.json')
 
   try:
-    tree = ET.parse(filename)
-  except:
+    with common.atomic_write(output) as f:
+      if json_lines:
+        for method in iter_methods(filename):
+          json.dump(method, f)
+          f.write('\n')
+      else:
+        f.write('{"invariants": [')
+        separator = ''
+        for method in iter_methods(filename):
+          f.write(separator)
+          json.dump(method, f)
+          separator = ', '
+        f.write(']}')
+  except ET.ParseError:
     common.log(args, 'jsoninv', f'Failed to parse {filename}')
-    return
-
-  invariants = tree.getroot()
-  methods = {}
-
-  for ppt in invariants:
-    add_ppt(methods, ppt)
-
-  js = {"invariants": list(methods.values())}
-
-  return js
-  
-def add_ppt(methods, ppt):
+    return None
+
+  return output
+
+def iter_methods(filename):
+  """The methods of the program points in filename, in order."""
+  method = None
+  descriptor = None
+  depth = 0
+  root = None
+
+  for event, element in ET.iterparse(filename, events=('start', 'end')):
+    if event == 'start':
+      if root is None:
+        root = element
+      depth += 1
+      continue
+
+    depth -= 1
+    if depth != 1:
+      continue
+
+    # element is a whole program point
+    ppt = ppt_method(element)
+    if ppt:
+      ppt_descriptor, ppt_method_info = ppt
+      if ppt_descriptor != descriptor:
+        if method:
+          yield method
+        descriptor = ppt_descriptor
+        method = ppt_method_info
+      for inv in element.iter('INVINFO'):
+        add_inv(method, inv)
+
+    # drop the program point, and the root's reference to it
+    root.clear()
+
+  if method:
+    yield method
+
+def ppt_method(ppt):
   class_name, method_name, args, point = ppt_info(ppt)
 
   if point not in ['ENTER', 'EXIT']:
-    return
-
-  method = find_method(methods, class_name, method_name, args)
+    return None
 
-  for inv in ppt.iter('INVINFO'):
-    add_inv(method, inv)
+  descriptor = f"{class_name}.{method_name}({args})"
+  method = {"cls": class_name,
+            "method": method_name,
+            "params": args,
+            "preconds": [],
+            "postconds": []}
+  return descriptor, method
 
 def ppt_info(ppt):
   name = ppt.find('PPTNAME').text
@@ -44,7 +105,7 @@ def ppt_info(ppt):
   if '(' not in signature:
     return signature, None, None, point
 
-  match = re.match(r'(.*)\.([^\(.]+)\.?\((.*)\)', signature)
+  match = SIGNATURE_PATTERN.match(signature)
   class_name, method_name, args = match.groups()
   if args:
     args = args.split(', ')
@@ -53,24 +114,12 @@ def ppt_info(ppt):
 
   return class_name, method_name, args, point
 
-def find_method(methods, class_name, method_name, args):
-  descriptor = f"{class_name}.{method_name}({args})"
-  if descriptor not in methods:
-    methods[descriptor] = {"cls": class_name,
-                           "method": method_name,
-                           "params": args,
-                           "preconds": [],
-                           "postconds": []}
-
-  return methods[descriptor]
-
 def add_inv(method, inv):
   i = None
   point = inv.find('PARENT').text
   inv_txt = inv.find('INV').text
 
-  pattern = r'(.*) ([=!<>]+|one of) (.*)'
-  match = re.match(pattern, inv_txt)
+  match = INVARIANT_PATTERN.match(inv_txt)
   if match:
     left, op, right = match.groups()
     i = {"left": left, "right": right, "op": op}
@@ -1,18 +1,44 @@
+import argparse
 import datetime
-from filecmp import dircmp
+import json
+import re
 
 from datetime import datetime
-from . import common
+from . import ajava, common, compile_server
 import os
 import pprint
 import shutil
 import tempfile
+import timeit
 from distutils import dir_util
 
 # re-use existing CF build logic
 from . import check
 
-argparser = None
+def retention_policy(value):
+    if value in ("all", "final"):
+        return value
+    if value.isdigit() and int(value) > 0:
+        return int(value)
+    raise argparse.ArgumentTypeError(f"expected 'all', 'final' or a positive number, not {value!r}")
+
+argparser = argparse.ArgumentParser(add_help=False)
+wpi_group = argparser.add_argument_group('wpi arguments')
+
+wpi_group.add_argument('--wpi-incremental', action='store_true', dest='wpi_incremental',
+                       help='After the first iterations, only re-check the source files whose ajava '
+                            'files changed in the last iteration, the source files that mention them, '
+                            'the classes those mention, and the other callers of those classes')
+wpi_group.add_argument('--wpi-retain', metavar='<policy>', type=retention_policy,
+                       default='all', dest='wpi_retain',
+                       help="Which iterations' ajava files to keep once inference for a javac command "
+                            "is done: 'all' (the default), 'final' (only those used for the final "
+                            "type-checking run), or a number <k> (the final ones and the last <k>)")
+wpi_group.add_argument('--wpi-max-iterations', metavar='<n>', type=int, dest='wpi_max_iterations',
+                       help='Stop inferring annotations for a javac command after <n> iterations')
+wpi_group.add_argument('--wpi-timeout', metavar='<seconds>', type=int, dest='wpi_timeout',
+                       help='Stop inferring annotations for a javac command after the iteration that '
+                            'exceeds <seconds> seconds')
 
 # all options passed to javac by the build system are copied to the invocations
 # of javac that run the Checker Framework, except those that either exactly match
@@ -41,7 +67,24 @@ def run(args, javac_commands, jars):
     if args.extraJavacArgs is not None:
         checker_command += args.extraJavacArgs.split()
 
-    for jc in javac_commands:
+    server = compile_server.start(args, check.getArgumentsByVersion(jdkVersion))
+    try:
+        infer(args, javac_commands, checker_command, processorArg, jdkVersion, server)
+    finally:
+        compile_server.stop(server)
+
+def infer(args, javac_commands, checker_command, processorArg, jdkVersion, server):
+    """Infer annotations for each of javac_commands, running the Checker
+    Framework in server if it is not None."""
+    # Modules are inferred in build order, so the annotations inferred for a
+    # module's dependencies are available when it is inferred.
+    deps = common.dependencies(javac_commands)
+    final_ajava_dirs = {}
+    # how the ajava files changed in each iteration, and how inference ended,
+    # for every javac command
+    convergence = {'iterations': [], 'javac_commands': []}
+
+    for i, jc in enumerate(javac_commands):
 
         # something searchable to delineate different javac commands
         common.run_cmd(["echo", "\"-----------------------------------------------------------\""], args, "wpi")
@@ -53,8 +96,13 @@ def run(args, javac_commands, jars):
 
         iteration = 0
         diffResult = True
+        stopReason = None
+        startTime = timeit.default_timer()
         ajavaDirs = []
+        manifests = []
+        digests = []
         resultsDir = tempfile.mkdtemp(prefix="wpi-ajava-" + datetime.now().strftime("%Y%m%d-%H%M%S") + "-")
+        store = ajava.IterationStore(resultsDir)
 
         print("Directory for generated annotation files: " + str(resultsDir))
 
@@ -154,6 +202,14 @@ def run(args, javac_commands, jars):
             checker_command = [arg for arg in checker_command if not arg.startswith("--add-opens")]
             other_args = [arg for arg in other_args if not arg.startswith("--add-opens")]
 
+        # the source files to check in the next iteration; with --wpi-incremental,
+        # this shrinks to the files affected by the ajava files that changed
+        iterationJavaFiles = java_files
+
+        otherAjavaDirs = [final_ajava_dirs[j] for j in deps[i] if j in final_ajava_dirs]
+        if args.ajava:
+            otherAjavaDirs.append(str(args.ajava))
+
         while diffResult:
             iterationCheckerCmd = checker_command.copy()
             # TODO: the switch to ajava files instead of stub files should make the separate stubs argument
@@ -164,9 +220,7 @@ def run(args, javac_commands, jars):
                 iterationCheckerCmd.append("-Astubs=" + str(args.stubs))
             # only use the last element in ajavaDirs, to avoid an ambiguity warning that would be issued
             # if two ajava files for the same source file were to be passed
-            iterationAjavaDirs = [ajavaDirs[-1]] if ajavaDirs else []
-            if args.ajava:
-                iterationAjavaDirs.append(str(args.ajava))
+            iterationAjavaDirs = ([ajavaDirs[-1]] if ajavaDirs else []) + otherAjavaDirs
             if iterationAjavaDirs:
                 iterationCheckerCmd.append(
                     "-Aajava=" + ":".join(iterationAjavaDirs))
@@ -178,35 +232,155 @@ def run(args, javac_commands, jars):
 
             pprint.pformat(jc)
 
-            cmd = iterationCheckerCmd + ["-classpath", cp] + processorArg + other_args + java_files
-            stats = common.run_cmd(cmd + ["-Ainfer=ajava", "-Awarns"], args, 'wpi')
+            cmd = common.with_checker_heap(jc, iterationCheckerCmd + ["-classpath", cp] + processorArg + other_args + java_files)
+            inferCmd = cmd
+            if iterationJavaFiles is not java_files:
+                # the files that are not re-checked are read from the build's class files,
+                # with their annotations taken from the previous iteration's ajava files
+                iterationCp = cp.rstrip(":") + ":" + common.class_directory(jc)
+                inferCmd = common.with_checker_heap(jc, iterationCheckerCmd + ["-classpath", iterationCp] + processorArg + other_args + iterationJavaFiles)
+            stats = common.run_cmd(compile_server.command(server, inferCmd + ["-Ainfer=ajava", "-Awarns"]), args, 'wpi',
+                                   heap=compile_server.client_heap(server, jc, inferCmd))
 
             # process outputs
             # move the old wpi files, add them to ajava path
-            previousIterationDir = os.path.join(resultsDir, "iteration" + str(iteration))
-            os.mkdir(previousIterationDir)
             iteration += 1
-            try:
-                ajavaFiles = os.listdir(wpiDir)
-            except OSError as e:
+            if not os.path.isdir(wpiDir):
                 print("No WPI outputs were discovered; it is likely that WPI failed or the Checker Framework crashed.")
                 print("Check the file " + os.path.join(os.getcwd(), 'dljc-out', 'wpi.log') + " for more information.")
-                raise e
+                raise FileNotFoundError(wpiDir)
 
-            for ajavaFile in ajavaFiles:
-                shutil.move(os.path.join(wpiDir, ajavaFile),
-                            previousIterationDir)
+            # only the re-checked files have new ajava files; the others are
+            # carried over from the previous iteration
+            baseManifest = manifests[-1] if iterationJavaFiles is not java_files else None
+            previousIterationDir, manifest = store.add_iteration(wpiDir, baseManifest)
+            shutil.rmtree(wpiDir)
 
             ajavaDirs.append(previousIterationDir)
+            manifests.append(manifest)
+            digests.append(ajava.digest(manifests[-1]))
 
             if len(ajavaDirs) > 1:
-                dcmp = dircmp(ajavaDirs[-1], ajavaDirs[-2])
-                diffResult = has_differing_files(dcmp)
+                changes = ajava.compare(ajavaDirs[-2], manifests[-2], ajavaDirs[-1], manifests[-1])
+                common.log(args, 'wpi', f"WPI iteration {iteration - 1}: {ajava.summary(changes)}\n")
+                convergence['iterations'].append(dict(changes, javac_command=i + 1, iteration=iteration - 1))
+                write_convergence_report(args, convergence)
+
+                changedFiles = ajava.changed_files(changes)
+                diffResult = bool(changedFiles)
+                if diffResult and digests[-1] in digests[:-1]:
+                    # the annotations are back to those of an earlier iteration, so
+                    # they would keep cycling forever
+                    stopReason = "cycle"
+                if diffResult and args.wpi_incremental and common.class_directory(jc):
+                    iterationJavaFiles = affected_java_files(java_files, changedFiles)
+
+            if diffResult and not stopReason:
+                if args.wpi_max_iterations and iteration >= args.wpi_max_iterations:
+                    stopReason = "max-iterations"
+                elif args.wpi_timeout and timeit.default_timer() - startTime >= args.wpi_timeout:
+                    stopReason = "timeout"
+            if stopReason:
+                diffResult = False
+
+        finalIteration = len(ajavaDirs) - 1
+        if stopReason:
+            # the annotations did not reach a fixpoint; use those of the iteration
+            # that changed the least
+            finalIteration = best_iteration(convergence['iterations'], i + 1)
+            cmd = [arg for arg in cmd if not arg.startswith("-Aajava=")]
+            cmd = cmd[:1] + ["-Aajava=" + ":".join([ajavaDirs[finalIteration]] + otherAjavaDirs)] + cmd[1:]
+            common.log(args, 'wpi', f"WPI stopped without reaching a fixpoint ({stopReason}); "
+                                    f"using the annotations from iteration {finalIteration}\n")
+        final_ajava_dirs[i] = ajavaDirs[finalIteration]
 
         # Run one final time without "-Awarns", for the final user output.
-        common.run_cmd(cmd, args, 'wpi')
-
-
-def has_differing_files(dcmp):
-    return (dcmp.diff_files
-            or any(map(has_differing_files, dcmp.subdirs.values())))
+        common.run_cmd(compile_server.command(server, cmd), args, 'wpi',
+                       heap=compile_server.client_heap(server, jc, cmd))
+
+        if args.wpi_retain != "all":
+            keep = {finalIteration}
+            if args.wpi_retain != "final":
+                keep.update(range(len(ajavaDirs))[-args.wpi_retain:])
+            store.retain(keep)
+        diskUsage = store.disk_usage()
+        common.log(args, 'wpi', f"WPI kept {diskUsage['iterations_kept']} iterations in {resultsDir}: "
+                                f"{diskUsage['ajava_bytes']} bytes of ajava files, "
+                                f"{diskUsage['stored_bytes']} bytes on disk\n")
+
+        convergence['javac_commands'].append({'javac_command': i + 1,
+                                              'iterations': len(ajavaDirs),
+                                              'result': stopReason or "fixpoint",
+                                              'final_iteration': finalIteration,
+                                              'results_directory': resultsDir,
+                                              'disk_usage': diskUsage})
+        write_convergence_report(args, convergence)
+
+
+def write_convergence_report(args, convergence):
+    with open(os.path.join(args.output_directory, 'wpi-convergence.json'), 'w') as f:
+        json.dump(convergence, f, indent=4)
+
+def best_iteration(iterations, javac_command):
+    """The number of the iteration of javac_command whose annotations changed
+    the least from the iteration before, preferring later iterations."""
+    candidates = [it for it in iterations if it['javac_command'] == javac_command]
+    if not candidates:
+        return 0
+    best = min(candidates, key=lambda it: (it['annotations_changed'],
+                                           len(ajava.changed_files(it)),
+                                           -it['iteration']))
+    return best['iteration']
+
+IDENTIFIER = re.compile(r'\b[A-Za-z_$][\w$]*\b')
+
+def affected_java_files(java_files, changed_ajava_files):
+    """The source files that must be re-checked after the ajava files in
+    changed_ajava_files changed: the source files they are for, the files
+    that mention the classes those declare by name (their callers), the
+    files of the module's classes that any of those mention (their callees,
+    whose parameter annotations WPI infers from the call sites), and the
+    callers of those callees, so that every call site of a re-inferred
+    method is seen again.
+
+    WPI writes the ajava file for the source file a/b/C.java to
+    a/b/C-<checker>.ajava, so the source file is found from the path of the
+    ajava file."""
+    changed_sources = set()
+    class_names = set()
+    for ajavaFile in changed_ajava_files:
+        class_name = os.path.basename(ajavaFile).split('-')[0]
+        if ajavaFile.endswith('.ajava') and class_name:
+            changed_sources.add(os.path.join(os.path.dirname(ajavaFile), class_name + '.java'))
+            class_names.add(class_name)
+
+    if not class_names:
+        return java_files
+
+    # the module's classes, by the name of the source file declaring them,
+    # and the ones each source file mentions
+    module_classes = {}
+    for java_file in java_files:
+        module_classes.setdefault(os.path.basename(java_file)[:-len('.java')], []).append(java_file)
+    mentions = {}
+    for java_file in java_files:
+        try:
+            with open(java_file, errors='replace') as f:
+                mentions[java_file] = set(IDENTIFIER.findall(f.read())) & module_classes.keys()
+        except OSError:
+            return java_files
+
+    def callers(classes):
+        return {java_file for java_file in java_files if mentions[java_file] & classes}
+
+    affected = {java_file for java_file in java_files
+                if any(java_file.endswith(os.sep + source) or java_file == source
+                       for source in changed_sources)}
+    affected |= callers(class_names)
+    callees = set().union(*(mentions[java_file] for java_file in affected))
+    affected |= {java_file for name in callees for java_file in module_classes[name]}
+    affected |= callers(callees)
+
+    if not affected or len(affected) == len(java_files):
+        return java_files
+    return [java_file for java_file in java_files if java_file in affected]